@@ -0,0 +1,248 @@
+# bench_end_to_end.py - throughput and latency of the client modules against the local fake services
+
+# Starts benchmarks/fake_services.py in the background, points fromLastFm and fromOpenNotify at it
+# and times whole calls, exactly as the scripts make them:
+#   lastfm_paginated - fromLastFm.get_Paginated, chart pages
+#   lastfm_process - fromLastFm.process_responses on those pages, dedup plus one tag lookup per artist
+#   iss_overhead - fromOpenNotify.when_ISS_Overhead, one place at a time
+#   iss_overhead_bulk - fromOpenNotify.when_ISS_Overhead_bulk, every place at once
+#   scrape_metadata - metadata_scraper.scrape_page_metadata on the saved pages
+# For each scenario the median wall time over --repeat runs is reported, with items per second and
+# the per-request latency percentiles recorded by http_metrics.
+#
+# Nothing touches the network and every run starts from empty tag stores and caches, so the numbers
+# only move when the code (or the machine) does. Save a run with --json and check a later one against it
+# with --compare, which exits with status 1 when a scenario got slower by more than --tolerance.
+#
+# Run from the repository root:
+#   python benchmarks/bench_end_to_end.py --latency 0.02 --json baseline.json
+#   python benchmarks/bench_end_to_end.py --latency 0.02 --compare baseline.json
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# the modules create their SQLite files in the working directory, keep them out of the repository
+START_DIR = os.getcwd()
+WORK_DIR = tempfile.mkdtemp(prefix='bench_end_to_end-')
+os.chdir(WORK_DIR)
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+
+import fromLastFm  # noqa: E402
+import fromOpenNotify  # noqa: E402
+import http_client  # noqa: E402
+from http_metrics import METRICS  # noqa: E402
+from metadata_scraper import scrape_page_metadata  # noqa: E402
+from rate_limiter import TokenBucket  # noqa: E402
+from fake_services import FakeServices, FIXTURES  # noqa: E402
+
+SCENARIOS = {}
+
+
+def scenario(name, setup=None):
+    '''register a benchmark, run(args, prepared) returns the number of items it handled,
+    setup(args) runs once before the timed runs and its result is passed in as prepared'''
+    def register(run):
+        SCENARIOS[name] = (setup, run)
+        return run
+    return register
+
+
+def places(count, seed=0):
+    '''Returns: list of (latitude, longitude), far enough apart not to share a pass cache entry'''
+    generator = random.Random(seed)
+    return [(round(generator.uniform(-80, 80), 3), round(generator.uniform(-180, 180), 3)) for _ in range(count)]
+
+
+def fetch_chart(args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fromLastFm.get_Paginated(args.pages, args.workers)
+
+
+@scenario('lastfm_paginated')
+def bench_paginated(args, prepared):
+    return len(fromLastFm.get_Paginated(args.pages, args.workers))
+
+
+@scenario('lastfm_process', setup=fetch_chart)
+def bench_process(args, prepared):
+    return len(fromLastFm.process_responses(prepared))
+
+
+@scenario('iss_overhead', setup=lambda args: places(args.calls))
+def bench_overhead(args, prepared):
+    for latitude, longitude in prepared:
+        fromOpenNotify.when_ISS_Overhead(latitude, longitude, number=5)
+    return len(prepared)
+
+
+@scenario('iss_overhead_bulk', setup=lambda args: places(args.calls))
+def bench_overhead_bulk(args, prepared):
+    fromOpenNotify.when_ISS_Overhead_bulk(prepared, number=5, workers=args.workers)
+    return len(prepared)
+
+
+@scenario('scrape_metadata', setup=lambda args: sorted(name for name in os.listdir(FIXTURES) if name.endswith('.html')))
+def bench_scrape(args, prepared):
+    for i in range(args.calls):
+        scrape_page_metadata(f'{args.base_url}/html/{prepared[i % len(prepared)]}')
+    return args.calls
+
+
+def request_summary():
+    '''Returns: the http_metrics of the last run, per endpoint: requests, errors, retries and latency percentiles in ms'''
+    summary = {}
+    for endpoint, stats in METRICS.to_dict()['endpoints'].items():
+        total = stats['latency_seconds']['total']
+        # the port changes from run to run, keep the names comparable
+        name = endpoint.split('/', 1)[1] if '/' in endpoint else endpoint
+        summary['/' + name] = {
+            'requests': stats['counters']['requests'],
+            'errors': stats['counters']['errors'],
+            'retries': stats['counters']['retries'],
+            **{f'p{float(q) * 100:g}_ms': value * 1000 for q, value in total['quantiles'].items() if value is not None},
+        }
+    return summary
+
+
+def run_scenario(name, args, services):
+    setup, run = SCENARIOS[name]
+    times = []
+    items = 0
+
+    for i in range(args.repeat):
+        # fresh tag store, pass cache and http cache for every run
+        os.chdir(tempfile.mkdtemp(dir=WORK_DIR))
+        fromOpenNotify.PASS_CACHE.clear()
+        if args.cache:
+            http_client.install_cache('http_cache.sqlite')
+
+        prepared = setup(args) if setup else None
+        METRICS.reset()
+        services.reset_counters()
+
+        # the modules print their results, which is not what is being measured
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            items = run(args, prepared)
+            times.append(time.perf_counter() - start)
+
+    seconds = statistics.median(times)
+    return {
+        'items': items,
+        'seconds': seconds,
+        'seconds_min': min(times),
+        'items_per_second': items / seconds if seconds else None,
+        'requests': request_summary(),
+        'server': dict(services.counters),
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    '''print the change against a saved run
+    Returns: names of the scenarios that got slower by more than tolerance'''
+    with open(baseline_path, encoding='utf-8') as file:
+        baseline = json.load(file)['scenarios']
+
+    print(f'\ncompared with {baseline_path}')
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f'  {name:<20} not in the baseline')
+            continue
+        change = result['seconds'] / baseline[name]['seconds'] - 1
+        verdict = ''
+        if change > tolerance:
+            verdict = 'SLOWER'
+            slower.append(name)
+        elif change < -tolerance:
+            verdict = 'faster'
+        print(f'  {name:<20}{baseline[name]["seconds"]:>10.3f}s ->{result["seconds"]:>8.3f}s {change:>+8.1%}  {verdict}')
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the client modules against local fake services')
+    parser.add_argument('scenarios', nargs='*', help=f'the scenarios to run, all by default: {", ".join(SCENARIOS)}')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario, the median is reported')
+    parser.add_argument('--pages', type=int, default=2, help='chart pages (500 artists each) for the Last.fm scenarios')
+    parser.add_argument('--calls', type=int, default=50, help='places for the ISS scenarios, pages for the scraper')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent requests where the module supports it')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the server waits before every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many random extra seconds per response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with a 429')
+    parser.add_argument('--lastfm-rate', type=float, default=0, help='Last.fm requests per second, 0 for no limit')
+    parser.add_argument('--cache', action='store_true', help='keep the http cache installed (empty at the start of each run)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='a --json file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='slow down allowed by --compare, 0.10 = 10%%')
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    services = FakeServices(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate, seed=args.seed).start()
+    args.base_url = services.url
+    fromLastFm.API_URL = f'{services.url}/2.0/'
+    fromOpenNotify.API_URL = services.url
+
+    # the real budget is 4 a second, without a limit the numbers show what the code itself can do
+    if args.lastfm_rate:
+        fromLastFm.RATE_LIMITER = TokenBucket(rate=args.lastfm_rate)
+    else:
+        fromLastFm.RATE_LIMITER = TokenBucket(rate=1e9)
+
+    http_client.uninstall_cache()
+    http_client.configure(pool_maxsize=max(args.workers, http_client.SETTINGS['pool_maxsize']))
+
+    results = {}
+    try:
+        print(f'{"scenario":<20}{"items":>8}{"seconds":>10}{"items/s":>10}{"requests":>10}{"p50 ms":>9}{"p99 ms":>9}')
+        for name in args.scenarios or SCENARIOS:
+            result = results[name] = run_scenario(name, args, services)
+            endpoints = result['requests'].values()
+            requests = sum(endpoint['requests'] for endpoint in endpoints)
+            # latency of the busiest endpoint, which is what the scenario mostly waits on
+            busiest = max(endpoints, key=lambda endpoint: endpoint['requests'], default={})
+            print(f'{name:<20}{result["items"]:>8}{result["seconds"]:>10.3f}{result["items_per_second"]:>10.1f}'
+                  f'{requests:>10}{busiest.get("p50_ms", 0):>9.2f}{busiest.get("p99_ms", 0):>9.2f}')
+    finally:
+        services.stop()
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('json', 'compare', 'base_url')}
+    output = {
+        'settings': settings,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'scenarios': results,
+    }
+    # the working directory was changed at import, file names are relative to where the script was started
+    if args.json:
+        with open(os.path.join(START_DIR, args.json), 'w', encoding='utf-8') as file:
+            json.dump(output, file, indent=2)
+
+    if args.compare:
+        if compare(results, os.path.join(START_DIR, args.compare), args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
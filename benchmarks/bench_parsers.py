@@ -0,0 +1,107 @@
+# bench_parsers.py - parse and extract time per HTML parser backend on the saved fixtures
+
+# For every installed backend and every page in benchmarks/fixtures this times:
+#   parse - building the tree (the soup, or the selectolax tree)
+#   words - get_top_words' entry-content word count, select_texts + count_words
+#   metadata - metadata_scraper.extract_metadata, BeautifulSoup backends only
+# and checks the output against html.parser, so a fast backend that gets the page wrong shows up.
+#
+# Run from the repository root: python benchmarks/bench_parsers.py [--repeat 20] [--json results.json]
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import html_parsers  # noqa: E402
+from metadata_scraper import extract_record  # noqa: E402
+from word_counter import count_words  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+BASE_URL = 'https://fixture.example/page'
+REFERENCE = 'html.parser'
+
+
+def timed(function, repeat):
+    '''Returns: (last result, list of run times in milliseconds)'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, times
+
+
+def parse(markup, backend):
+    if backend == 'selectolax':
+        return html_parsers.lexbor_parser(markup)
+    return html_parsers.make_soup(markup, backend)
+
+
+def bench_page(markup, backend, repeat):
+    row = {}
+
+    _, times = timed(lambda: parse(markup, backend), repeat)
+    row['parse_ms'] = statistics.median(times)
+
+    words, times = timed(lambda: count_words(html_parsers.select_texts(markup, 'div', 'entry-content', backend)), repeat)
+    row['words_ms'] = statistics.median(times)
+    row['words'] = words
+
+    if backend != 'selectolax':
+        metadata, times = timed(lambda: extract_record(markup, BASE_URL, parser=backend), repeat)
+        row['metadata_ms'] = statistics.median(times)
+        row['metadata'] = metadata
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare HTML parser backends on the saved fixtures')
+    parser.add_argument('--repeat', type=int, default=10, help='runs per measurement, the median is reported')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    backends = html_parsers.available_backends()
+    pages = sorted(name for name in os.listdir(FIXTURES) if name.endswith('.html'))
+    print(f'backends: {", ".join(backends)}')
+
+    results = []
+    for page in pages:
+        with open(os.path.join(FIXTURES, page), encoding='utf-8') as file:
+            markup = file.read()
+
+        rows = {backend: bench_page(markup, backend, args.repeat) for backend in backends}
+        reference = rows[REFERENCE]
+
+        print(f'\n{page} ({len(markup) // 1024} KB)')
+        print(f'  {"backend":<12}{"parse ms":>10}{"words ms":>10}{"meta ms":>10}  output')
+        for backend, row in rows.items():
+            same_words = row['words'] == reference['words']
+            same_metadata = 'metadata' not in row or row['metadata'] == reference['metadata']
+            verdict = 'same as html.parser' if same_words and same_metadata else (
+                'words differ' if not same_words else 'metadata differs')
+            metadata_ms = f'{row["metadata_ms"]:>10.2f}' if 'metadata_ms' in row else f'{"-":>10}'
+            print(f'  {backend:<12}{row["parse_ms"]:>10.2f}{row["words_ms"]:>10.2f}{metadata_ms}  {verdict}')
+
+            results.append({
+                'page': page,
+                'backend': backend,
+                'parse_ms': row['parse_ms'],
+                'words_ms': row['words_ms'],
+                'metadata_ms': row.get('metadata_ms'),
+                'same_words': same_words,
+                'same_metadata': same_metadata,
+            })
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'repeat': args.repeat, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
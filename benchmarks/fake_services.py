@@ -0,0 +1,206 @@
+# fake_services.py - a local stand-in for Last.fm, Open-Notify and a few web pages, for offline benchmarks
+
+# Serves the recorded responses in benchmarks/fixtures:
+#   /2.0/?method=chart.gettopartists&page=N&limit=L - L artists, built from the recorded chart page,
+#       every name made unique per page and position so dedup and tag lookups behave like the real chart
+#   /2.0/?method=artist.gettoptags&artist=NAME - the recorded top tags, for any artist
+#   /iss-now.json, /iss-pass.json?n=N, /astros.json - the recorded Open-Notify answers
+#   /html/NAME.html - the saved pages
+# Every response can be slowed down and made to fail:
+#   latency + up to jitter seconds before answering,
+#   error_rate of the requests answered with a 503, throttle_rate with a 429 and a Retry-After header.
+# The random choices come from a seeded generator, so the same settings fail the same share of requests.
+#
+# Run it on its own to point the scripts at it by hand:
+#   python benchmarks/fake_services.py --port 8000 --latency 0.05
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as file:
+        return file.read()
+
+
+class FakeServices:
+    '''The stand-in server, running in a background thread.
+    Params:
+        latency - seconds every response is delayed by
+        jitter - up to this many extra seconds, picked at random per request
+        error_rate - share of requests answered with a 503
+        throttle_rate - share of requests answered with a 429
+        retry_after - the Retry-After seconds sent with a 429
+        seed - seed of the random generator
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.counters = {'requests': 0, 'errors': 0, 'throttled': 0, 'not_found': 0, 'bytes': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.chart = json.loads(load_fixture('lastfm_chart_gettopartists.json'))
+        self.toptags = json.loads(load_fixture('lastfm_artist_gettoptags.json'))
+        self.passes = json.loads(load_fixture('iss-pass.json'))
+        self.files = {
+            '/iss-now.json': load_fixture('iss-now.json'),
+            '/astros.json': load_fixture('astros.json'),
+        }
+        for name in os.listdir(FIXTURES):
+            if name.endswith('.html'):
+                self.files[f'/html/{name}'] = load_fixture(name)
+
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_port}'
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _draw(self):
+        '''Returns: (delay in seconds, 'error' / 'throttle' / None) for the next request'''
+        with self._lock:
+            delay = self.latency + self._random.random() * self.jitter
+            roll = self._random.random()
+        if roll < self.error_rate:
+            return delay, 'error'
+        if roll < self.error_rate + self.throttle_rate:
+            return delay, 'throttle'
+        return delay, None
+
+    def chart_page(self, page, limit):
+        artists = self.chart['artists']['artist']
+        first = (page - 1) * limit
+        page_artists = []
+        for position in range(first, first + limit):
+            artist = dict(artists[position % len(artists)])
+            if position >= len(artists):
+                artist['name'] = f'{artist["name"]} {position}'
+            page_artists.append(artist)
+        attributes = dict(self.chart['artists']['@attr'], page=str(page), perPage=str(limit))
+        return {'artists': {'artist': page_artists, '@attr': attributes}}
+
+    def respond(self, path, query):
+        '''Returns: (status, body bytes) for a request'''
+        if path in self.files:
+            return 200, self.files[path]
+
+        if path == '/2.0/':
+            method = query.get('method', [''])[0].lower()
+            if method == 'chart.gettopartists':
+                page = int(query.get('page', ['1'])[0])
+                limit = int(query.get('limit', ['50'])[0])
+                return 200, json.dumps(self.chart_page(page, limit)).encode('utf-8')
+            if method == 'artist.gettoptags':
+                tags = dict(self.toptags['toptags'], **{'@attr': {'artist': query.get('artist', [''])[0]}})
+                return 200, json.dumps({'toptags': tags}).encode('utf-8')
+            return 400, json.dumps({'error': 3, 'message': 'Invalid Method'}).encode('utf-8')
+
+        if path == '/iss-pass.json':
+            number = int(query.get('n', ['5'])[0])
+            passes = self.passes['response']
+            data = dict(self.passes, response=[passes[i % len(passes)] for i in range(number)])
+            data['request'] = dict(data['request'], latitude=float(query.get('lat', ['0'])[0]),
+                                   longitude=float(query.get('lon', ['0'])[0]), passes=number)
+            return 200, json.dumps(data).encode('utf-8')
+
+        return 404, b'not found'
+
+    def _handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real services
+            # headers and body go out in separate writes, without this every response waits on a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                services._count('requests')
+                delay, failure = services._draw()
+                if delay:
+                    time.sleep(delay)
+
+                headers = {}
+                if failure == 'error':
+                    services._count('errors')
+                    status, body = 503, b'injected error'
+                elif failure == 'throttle':
+                    services._count('throttled')
+                    status, body = 429, b'injected rate limit'
+                    headers['Retry-After'] = str(services.retry_after)
+                else:
+                    parts = urlsplit(self.path)
+                    status, body = services.respond(parts.path, parse_qs(parts.query))
+                    if status == 404:
+                        services._count('not_found')
+
+                content_type = 'text/html' if self.path.startswith('/html/') else 'application/json'
+                self.send_response(status)
+                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                services._count('bytes', len(body))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the recorded Last.fm, Open-Notify and HTML fixtures locally')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many random extra seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with a 429')
+    parser.add_argument('--retry-after', type=int, default=0, help='Retry-After seconds sent with a 429')
+    args = parser.parse_args()
+
+    services = FakeServices(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    print(f'serving on {services.url}, Ctrl+C to stop')
+    print(f'  fromLastFm.API_URL = {services.url}/2.0/')
+    print(f'  fromOpenNotify.API_URL = {services.url}')
+    try:
+        services.server.serve_forever()
+    except KeyboardInterrupt:
+        services.server.server_close()
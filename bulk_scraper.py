@@ -0,0 +1,179 @@
+"""Scrape metadata for a stream of URLs concurrently, writing newline-delimited JSON."""
+# Downloads run in a thread pool (the shared http_client session is blocking),
+# the HTML parse runs in a process pool, and asyncio ties the two together.
+# At most max_concurrency URLs are in progress at once, and at most per_domain of them per host,
+# so one big site can't take every slot or get hammered.
+# URLs whose host is already at per_domain wait in that host's own queue without taking a slot,
+# so input grouped by host (sitemaps, link dumps) still keeps every slot busy with the other hosts.
+# The input is read on its own thread, a slow pipe doesn't hold up the URLs in progress.
+# Each result is written as one JSON line as soon as it's ready, in completion order.
+
+import argparse
+import asyncio
+import json
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlsplit
+import http_client
+from metadata_scraper import HEADERS, extract_record
+
+
+class HostQueues:
+    """URLs waiting to start, a queue per host, handed out so at most per_domain per host are in progress.
+
+    Hosts take turns, and a host is dropped again once nothing of it is waiting or in progress.
+    """
+
+    def __init__(self, per_domain):
+        self.per_domain = per_domain
+        self.waiting = 0
+        self._queues = {}  # host -> deque of waiting urls
+        self._active = {}  # host -> urls in progress
+        self._ready = {}  # hosts with a waiting url and a free slot, a dict keeps them in turn order
+
+    def add(self, url):
+        host = urlsplit(url).hostname or ''
+        self._queues.setdefault(host, deque()).append(url)
+        self.waiting += 1
+        if self._active.get(host, 0) < self.per_domain:
+            self._ready[host] = None
+
+    def next(self):
+        """Returns (host, url) to start now, or None if every waiting URL's host is at its limit."""
+        if not self._ready:
+            return None
+        host = next(iter(self._ready))
+        del self._ready[host]
+
+        queue = self._queues[host]
+        url = queue.popleft()
+        self.waiting -= 1
+        self._active[host] = self._active.get(host, 0) + 1
+        if not queue:
+            del self._queues[host]
+        elif self._active[host] < self.per_domain:
+            # to the back, the other ready hosts go first
+            self._ready[host] = None
+        return host, url
+
+    def done(self, host):
+        self._active[host] -= 1
+        if not self._active[host]:
+            # keeps memory flat over millions of distinct hosts
+            del self._active[host]
+        if host in self._queues:
+            self._ready[host] = None
+
+
+def fetch(url):
+    """Download one page, returns the body bytes."""
+    response = http_client.get(url, headers=HEADERS)
+    response.raise_for_status()
+    return response.content
+
+
+async def scrape_many(urls, out=sys.stdout, max_concurrency=64, per_domain=4, processes=None, links=False, words=False,
+                      backlog=10000):
+    """Scrape every URL in an iterable and write one JSON line per URL to out.
+
+    Failed URLs are written as {"url": ..., "error": ...}.
+    At most backlog URLs are read ahead of the ones in progress, so a huge input isn't loaded all at once.
+    Returns the number of URLs processed.
+    """
+    loop = asyncio.get_running_loop()
+    hosts = HostQueues(per_domain)
+    lines = iter(urls)
+    tasks = set()
+    count = 0
+    running = 0
+    read_all = False
+    # set whenever a URL was read or finished, the loop below then starts whatever can start
+    changed = asyncio.Event()
+    # set whenever a waiting URL started, the reader then reads on if it had stopped at the backlog
+    room = asyncio.Event()
+
+    # keep a connection per concurrent request to the same host
+    http_client.configure(pool_maxsize=max(per_domain, http_client.SETTINGS['pool_maxsize']))
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as fetchers, ProcessPoolExecutor(max_workers=processes) as parsers, \
+            ThreadPoolExecutor(max_workers=1) as reader:
+
+        async def read_input():
+            nonlocal count, read_all
+            try:
+                while True:
+                    while hosts.waiting >= backlog:
+                        room.clear()
+                        await room.wait()
+                    # next() blocks on a slow pipe, off the event loop
+                    line = await loop.run_in_executor(reader, next, lines, None)
+                    if line is None:
+                        return
+                    url = line.strip()
+                    if url:
+                        hosts.add(url)
+                        count += 1
+                        changed.set()
+            finally:
+                read_all = True
+                changed.set()
+
+        async def scrape(host, url):
+            nonlocal running
+            try:
+                try:
+                    content = await loop.run_in_executor(fetchers, fetch, url)
+                    record = await loop.run_in_executor(parsers, extract_record, content, url, links, words)
+                except Exception as err:
+                    record = {'url': url, 'error': f'{type(err).__name__}: {err}'}
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+            finally:
+                running -= 1
+                hosts.done(host)
+                changed.set()
+
+        reading = asyncio.create_task(read_input())
+        while True:
+            started = False
+            while running < max_concurrency:
+                item = hosts.next()
+                if item is None:
+                    break
+                running += 1
+                task = asyncio.create_task(scrape(*item))
+                # the loop only keeps weak references to tasks
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                started = True
+            if started:
+                room.set()
+
+            if read_all and not hosts.waiting and not running:
+                break
+            changed.clear()
+            await changed.wait()
+
+        # re-raises an error from reading the input
+        await reading
+
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scrape metadata for many URLs, one JSON object per line')
+    parser.add_argument('input', nargs='?', default='-', help='file with one URL per line, - for stdin')
+    parser.add_argument('--concurrency', type=int, default=64, help='URLs in progress at once')
+    parser.add_argument('--per-domain', type=int, default=4, help='URLs in progress at once per host')
+    parser.add_argument('--processes', type=int, default=None, help='parser processes, defaults to one per core')
+    parser.add_argument('--links', action='store_true', help='include the page links')
+    parser.add_argument('--words', action='store_true', help='include the most used words')
+    args = parser.parse_args()
+
+    http_client.install_cache()
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    with source:
+        asyncio.run(scrape_many(source, max_concurrency=args.concurrency, per_domain=args.per_domain,
+                                processes=args.processes, links=args.links, words=args.words))
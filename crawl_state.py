@@ -0,0 +1,61 @@
+# crawl_state.py - checkpoints for long Last.fm pulls, kept in a small SQLite file
+
+# Records which pages are safely on disk and which artist tag lookups are still to do,
+# so a crawl that dies halfway can pick up where it left off instead of starting over.
+
+import json
+import sqlite3
+
+
+class CrawlState:
+    '''Checkpoint store for one crawl.
+    Params:
+        path - the SQLite file to keep the state in
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS pages (page INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS pending_tags (name TEXT PRIMARY KEY);
+        ''')
+
+    def reset(self, **settings):
+        '''forget the previous crawl and record the settings of a new one'''
+        with self.conn:
+            self.conn.execute('DELETE FROM settings')
+            self.conn.execute('DELETE FROM pages')
+            self.conn.execute('DELETE FROM pending_tags')
+            self.conn.executemany('INSERT INTO settings (key, value) VALUES (?, ?)',
+                                  [(key, json.dumps(value)) for key, value in settings.items()])
+
+    def settings(self):
+        '''Returns: dictionary of the settings passed to reset()'''
+        return {key: json.loads(value) for key, value in self.conn.execute('SELECT key, value FROM settings')}
+
+    def completed_pages(self):
+        '''Returns: set of page numbers already on disk'''
+        return {page for (page,) in self.conn.execute('SELECT page FROM pages')}
+
+    def mark_pages_done(self, pages):
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO pages (page) VALUES (?)', [(page,) for page in pages])
+
+    def pending_tags(self):
+        '''Returns: list of artist names still waiting for a tag lookup'''
+        return [name for (name,) in self.conn.execute('SELECT name FROM pending_tags')]
+
+    def set_pending_tags(self, names):
+        '''replace the pending list with names'''
+        with self.conn:
+            self.conn.execute('DELETE FROM pending_tags')
+            self.conn.executemany('INSERT OR IGNORE INTO pending_tags (name) VALUES (?)', [(name,) for name in names])
+
+    def remove_pending_tags(self, names):
+        with self.conn:
+            self.conn.executemany('DELETE FROM pending_tags WHERE name = ?', [(name,) for name in names])
+
+    def close(self):
+        self.conn.close()
@@ -20,25 +20,93 @@
 
 
 import requests
-import requests_cache
 import json
 import http
 import logging
 import datetime
 import time
-import pandas as pd
-from tqdm import tqdm
+import sqlite3
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import TokenBucket
+import http_client
+import http_metrics
+from crawl_state import CrawlState
+from log_setup import PAYLOAD_SETTINGS, setup_logging, log_payload
 
-logging.basicConfig(filename=f'{__file__}.log', level=logging.DEBUG, filemode='w', format='%(levelname)s:\n%(message)s\n')
+API_KEY = '**********************************'
+USER_AGENT = 'LastAppi'
 
-# Changing the logging debug level greater than 0 will log the response HTTP headers to stdout.
-# useful if you're dealing with an API that returns a large body payload that is not suitable for logging or contains binary content.
-http.client.HTTPConnection.debuglevel = 1
+# Every call goes to this url, point it somewhere else (e.g. benchmarks/fake_services.py) to run offline
+API_URL = r'http://ws.audioscrobbler.com/2.0/'
 
-requests_cache.install_cache()
+# One bucket for the whole process: every lastfm_get call, from any thread, takes a token from it.
+# 4 requests a second is the same budget the old time.sleep(0.25) per call aimed for.
+RATE_LIMITER = TokenBucket(rate=4, capacity=4)
 
-API_KEY = '**********************************'
-USER_AGENT = 'LastAppi'
+# Local SQLite file memoizing artist name -> top tags, so later runs only ask last.fm about new artists
+TAG_STORE = 'artist_tags.sqlite'
+
+# Checkpoints of the paginated pull, used by --resume
+CRAWL_STATE = 'crawl_state.sqlite'
+
+# Columns kept from each artist object, 'image' is dropped as soon as a page is parsed
+ARTIST_COLUMNS = ['name', 'playcount', 'listeners', 'mbid', 'url', 'streamable']
+
+def artist_dtypes():
+    '''compact dtypes of the artist columns, last.fm sends every value as a string
+    counts become int64 (playcounts pass 2**31) and int32 (listeners don't),
+    text becomes Arrow backed strings when pyarrow is installed, a fraction of the memory of Python str objects,
+    streamable ('0' or '1') becomes a categorical with fixed categories, so pages concatenate without falling back to object
+    Returns: dictionary of column -> dtype
+    '''
+    import pandas as pd
+
+    try:
+        import pyarrow  # noqa: F401
+        text = pd.StringDtype('pyarrow')
+    except ImportError:
+        text = pd.StringDtype()
+
+    return {
+        'name': text,
+        'playcount': 'int64',
+        'listeners': 'int32',
+        'mbid': text,
+        'url': text,
+        'streamable': pd.CategoricalDtype(['0', '1']),
+    }
+
+def compact_artists(artists):
+    '''give the artist columns their compact dtypes, columns that already have them are left alone
+    Counts that aren't numbers raise ValueError, as the plain astype(int) did,
+    counts too big for the compact type stay int64 instead of wrapping around.
+    Returns: dataframe
+    '''
+    import numpy as np
+    import pandas as pd
+
+    columns = {}
+    for column, dtype in artist_dtypes().items():
+        if column not in artists or artists[column].dtype == dtype:
+            continue
+        values = artists[column]
+        if column in ('playcount', 'listeners'):
+            values = pd.to_numeric(values)
+            limits = np.iinfo(dtype)
+            if len(values) and (values.min() < limits.min or values.max() > limits.max):
+                logging.warning('%s has values outside %s, kept as int64', column, dtype)
+                dtype = 'int64'
+        elif column == 'streamable':
+            # read back from a CSV the flags are numbers
+            values = values.astype(str)
+            unknown = ~values.isin(dtype.categories) & artists[column].notna()
+            if unknown.any():
+                logging.warning('%s streamable values other than 0 or 1 stored as missing', int(unknown.sum()))
+        columns[column] = values.astype(dtype)
+    return artists.assign(**columns) if columns else artists
 
 def get_TopArtists():
     '''get the top artists utilizing Last.FM API'''
@@ -52,71 +120,247 @@ def get_TopArtists():
     #### '@attr' key = various response attributes
     #### 'artist' key = list of artist objects
 
-    logging.debug(f'@attr:\n{jprint(response.json()["artists"]["@attr"])}')
+    # decode the body once, log_payload only encodes it again on the logging thread, when it is sampled
+    data = response.json()
+    log_payload('chart attributes', data["artists"]["@attr"])
     # @attr:{
     # "page": "1",
     # "perPage": "50",
     # "total": "3723977",
     # "totalPages": "74480"}
 
-    total_pages = response.json()["artists"]["@attr"]["totalPages"]
+    total_pages = data["artists"]["@attr"]["totalPages"]
     print(total_pages)
 
 
-def get_Paginated():
-    '''gets paginated results from last.fm API
-    returns:
+def fetch_page(page, retries=3):
+    '''request one page of chart.gettopartists
+    failed attempts are retried with a growing back-off
+    params: page = the page number to fetch
+            retries = how many attempts to make before giving up
+    Returns: Response object or None if every attempt failed
     '''
 
-    # initialize list to hold results
-    result_pages = []
-
-    # set initial page and high total number
-    current_page = 1
-    total_pages = 5 # just a dummy number to start loop
-
-    # iterate over page number to get more result pages
-    while current_page <= total_pages:
-        logging.debug(f'Requesting page {current_page}/{total_pages}')
+    # construct dictionary for payload
+    payload = {
+        'method': 'chart.gettopartists',
+        'limit': 500,
+        'page': page
+        }
+
+    for attempt in range(1, retries + 1):
+        try:
+            # lastfm_get adds keys to the payload, so give it a copy
+            response = lastfm_get(dict(payload))
+        except requests.RequestException as err:
+            logging.warning('Page %s attempt %s failed: %s', page, attempt, err)
+            response = None
+
+        if response is not None:
+            return response
+
+        # back off before trying again: 0.5s, 1s, 2s...
+        if attempt < retries:
+            time.sleep(0.5 * 2 ** (attempt - 1))
+
+    logging.error('Giving up on page %s after %s attempts', page, retries)
+    return None
+
+
+def iter_pages(pages, workers=1):
+    '''fetch pages from last.fm and yield them in page order
+    With workers > 1 a bounded thread pool fetches pages ahead of the consumer,
+    the shared RATE_LIMITER keeps the whole process inside the request budget.
+    Stops at the first page that still fails after its retries.
+    params: pages = iterable of page numbers
+            workers = number of concurrent requests
+    Yields: (page number, Response object)
+    '''
+    if workers <= 1:
+        for page in pages:
+            logging.debug('Requesting page %s', page)
+            response = fetch_page(page)
+
+            # if we get an error halt the loop
+            if response is None:
+                break
+            yield page, response
+        return
+
+    pages = list(pages)
+    upcoming = iter(pages)
+    pending = {}
+
+    def submit_next():
+        page = next(upcoming, None)
+        if page is not None:
+            logging.debug('Requesting page %s', page)
+            pending[page] = executor.submit(fetch_page, page)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        # keep only a couple of pages per worker in flight so finished pages don't pile up in memory
+        for _ in range(workers * 2):
+            submit_next()
+
+        # hand the results back in page order
+        for page in pages:
+            response = pending.pop(page).result()
+            if response is None:
+                break
+            submit_next()
+            yield page, response
+    finally:
+        for future in pending.values():
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def get_Paginated(total_pages=5, workers=1):
+    '''gets paginated results from last.fm API
+    params: total_pages = number of pages to request
+            workers = number of pages to fetch concurrently
+    returns: list of Response objects in page order
+    '''
 
-        # construct dictionary for payload
-        payload = {
-            'method': 'chart.gettopartists',
-            'limit': 500,
-            'page': current_page
-            }
+    # Add each response to list
+    result_pages = [response for _, response in iter_pages(range(1, total_pages + 1), workers)]
 
-        # make the API Call
-        response = lastfm_get(payload)
+    print(len(result_pages))
+    return result_pages
 
-        # if we get an error, print the response and halt the loop
-        if response.status_code != 200:
-            logging.error(response.text)
-            break
+    # Using a local database to cache the results of any API call
+    #### You don’t make extra API calls that you don’t need to.
+    #### You don’t need to wait the extra time to rate limit when reading the repeated calls from the cache.
 
-        # Extract pagination details and update current_page and total_pages
-        current_page = int(response.json()["artists"]["@attr"]["page"])
-        #total_pages = int(response.json()["artists"]["@attr"]["totalPages"])
+def page_to_frame(response):
+    '''turn one page of chart.gettopartists into a dataframe
+    the image column is left out and every page gets the same columns in the same order
+    Returns: dataframe
+    '''
+    import pandas as pd
 
+    # the counts are parsed here, once per page, instead of on the whole table at export
+    return compact_artists(pd.DataFrame(response.json()['artists']['artist']).reindex(columns=ARTIST_COLUMNS))
 
-        # Add response to list
-        result_pages.append(response)
+class PageWriter:
+    '''Append artist pages to an on-disk table as they arrive.
+    A path ending in .csv is one CSV file appended to after every page.
+    Any other path is a directory of Parquet files (needs pyarrow),
+    a file is written every pages_per_file pages so only that many pages are held in memory.
+    '''
 
-        # If not from cached sleep for .25 second
-        if not getattr(response, 'from_cached', False):
-            time.sleep(0.25)
+    def __init__(self, path, pages_per_file=20):
+        self.path = path
+        self.is_csv = path.endswith('.csv')
+        self.pages_per_file = pages_per_file
+        self._frames = []
+        self._pages = []
+
+        if not self.is_csv:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, page, frame):
+        '''add one page to the output
+        Returns: list of the page numbers that are now on disk
+        '''
+        if self.is_csv:
+            # only write the header when starting a new file
+            header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            frame.to_csv(self.path, mode='a', header=header, index=False)
+            return [page]
+
+        self._frames.append(frame)
+        self._pages.append(page)
+        if len(self._frames) >= self.pages_per_file:
+            return self.flush()
+        return []
+
+    def flush(self):
+        '''write the buffered pages to a new Parquet file
+        Returns: list of the page numbers that were written
+        '''
+        if not self._frames:
+            return []
+
+        import pandas as pd
+
+        pages = self._pages
+        file_name = f'pages-{min(pages):06d}-{max(pages):06d}.parquet'
+        pd.concat(self._frames, ignore_index=True).to_parquet(os.path.join(self.path, file_name), index=False)
+
+        self._frames = []
+        self._pages = []
+        return pages
+
+    def close(self):
+        '''Returns: list of the page numbers written by the final flush'''
+        return self.flush()
+
+def stream_Paginated(path='artists_pages', total_pages=5, workers=1, resume=False, state_path=CRAWL_STATE):
+    '''gets paginated results from last.fm API and writes each page to disk as it arrives
+    Unlike get_Paginated no Response objects are kept, so memory stays flat however many pages are pulled.
+    Pages are checkpointed in the state file once they are on disk,
+    with resume=True the path and total_pages of the last crawl are reused and finished pages are skipped.
+    params: path = output, a .csv file or a directory for Parquet files
+            total_pages = number of pages to request
+            workers = number of pages to fetch concurrently
+            resume = continue the crawl recorded in the state file
+            state_path = the checkpoint file
+    returns: path, or None if some pages are still missing
+    '''
+    state = CrawlState(state_path)
+    try:
+        if resume:
+            settings = state.settings()
+            if not settings:
+                raise ValueError(f'No crawl to resume in {state_path}')
+            path, total_pages = settings['path'], settings['total_pages']
+        else:
+            # appending a new crawl to old output would mix the two
+            if os.path.exists(path) and (path.endswith('.csv') or os.listdir(path)):
+                raise FileExistsError(f'{path} already exists, continue that crawl with --resume or remove it first')
+            state.reset(path=path, total_pages=total_pages)
+
+        done = state.completed_pages()
+        todo = [page for page in range(1, total_pages + 1) if page not in done]
+        logging.info(f'{len(done)} pages already done, {len(todo)} to request')
+
+        writer = PageWriter(path)
+        try:
+            for page, response in iter_pages(todo, workers):
+                # only pages the writer reports as on disk are checkpointed
+                state.mark_pages_done(writer.write(page, page_to_frame(response)))
+        finally:
+            state.mark_pages_done(writer.close())
+
+        missing = total_pages - len(state.completed_pages())
+    finally:
+        state.close()
+
+    if missing:
+        logging.error(f'{missing} pages still missing, run again with --resume')
+        return None
 
-        # Next page
-        current_page += 1
+    logging.info(f'{total_pages} pages written to {path}')
+    return path
 
-    print(len(result_pages))
-    return result_pages
+def read_pages(path):
+    '''load the output of stream_Paginated
+    Returns: dataframe of every artist row written
+    '''
+    import pandas as pd
 
-    # Using a local database to cache the results of any API call
-    #### You don’t make extra API calls that you don’t need to.
-    #### You don’t need to wait the extra time to rate limit when reading the repeated calls from the cache.
+    if path.endswith('.csv'):
+        # parsed straight into the compact dtypes, except the counts and flags: read_csv wraps values too big
+        # for int32 and turns unknown categories into NaN without a word, compact_artists checks both
+        dtypes = dict(artist_dtypes(), playcount='int64', listeners='int64', streamable=str)
+        return compact_artists(pd.read_csv(path, dtype=dtypes))
+    return compact_artists(pd.read_parquet(path))
 
 def process_responses(responses):
+    import pandas as pd
+
     # Look at first responses data
     #r0 = responses[0]
     #r0_json = r0.json()
@@ -124,39 +368,144 @@ def process_responses(responses):
     #r0_df = pd.DataFrame(r0_artists)
     #r0_df.head()
 
-    # using list comprehension turn each response into a dataframe
-    frames = [pd.DataFrame(r.json()['artists']['artist']) for r in responses]
+    # using list comprehension turn each response into a dataframe, without the image column
+    frames = [page_to_frame(r) for r in responses]
 
     # combine all the Dataframes into one
     artists = pd.concat(frames)
     #artists.head()
 
-    # Remove the image column
-    artists = artists.drop('image', axis=1)
+    return process_artists(artists)
 
+def process_artists(artists, state_path=None):
+    '''remove duplicates and add the tags column
+    works on the frame built by process_responses or read back with read_pages
+    params: state_path = checkpoint file to record pending tag lookups in, optional
+    Returns: dataframe
+    '''
     # Remove Duplicates
+    # (a crash between writing a page and checkpointing it can also leave a page on disk twice)
     artists = artists.drop_duplicates().reset_index(drop=True)
 
-    tqdm.pandas()
-    # get_ArtistTags for each artist name in our artists dataframe
-    # displays a progress bar
-    artists['tags'] = artists['name'].progress_apply(get_ArtistTags)
+    # get the tags for each unique artist name and join them onto the dataframe
+    state = CrawlState(state_path) if state_path else None
+    try:
+        artists = enrich_with_tags(artists, state=state)
+    finally:
+        if state is not None:
+            state.close()
 
     logging.info(f'{artists.head()}')
     logging.info(f'{artists.describe()}')
 
     return artists
 
-def convertAndExport(artists):
-    # convert the listeners and playcount columns to numeric values
-    artists[["playcount", "listeners"]] = artists[["playcount", "listeners"]].astype(int)
-
-    # sort by listeners
-    artists = artists.sort_values("listeners", ascending=False)
+def open_tag_store(path=TAG_STORE):
+    '''open (and create if needed) the local artist tag store
+    Returns: sqlite3 Connection
+    '''
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE IF NOT EXISTS artist_tags (name TEXT PRIMARY KEY, tags TEXT)')
+    return conn
+
+def read_stored_tags(conn, names, chunk_size=500):
+    '''look up names in the tag store
+    queries in chunks to stay under SQLite's limit on bound parameters
+    Returns: dictionary of name -> tags for the names that are stored
+    '''
+    stored = {}
+    for i in range(0, len(names), chunk_size):
+        chunk = names[i:i + chunk_size]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(f'SELECT name, tags FROM artist_tags WHERE name IN ({placeholders})', chunk)
+        stored.update(rows)
+    return stored
+
+def enrich_with_tags(artists, workers=4, batch_size=200, store_path=TAG_STORE, state=None):
+    '''add a 'tags' column to the artists dataframe
+    Each unique artist name is looked up once, rows that only differ in mbid/url share the lookup.
+    Names already in the tag store are not requested again, the rest are fetched concurrently
+    (the shared RATE_LIMITER keeps to the request budget) and saved after every batch.
+    params: artists = dataframe with a 'name' column
+            workers = number of concurrent tag requests
+            batch_size = number of names fetched between commits to the tag store
+            state = CrawlState to record the pending lookups in, optional,
+                    the names still pending at the end are the lookups that failed
+    Returns: dataframe with the 'tags' column merged on
+    '''
+    import pandas as pd
+    from tqdm import tqdm
 
-    logging.info(f'{artists.head(10)}')
+    names = artists['name'].dropna().unique().tolist()
 
-    artists.to_csv('artists.csv', index=False)
+    conn = open_tag_store(store_path)
+    try:
+        tags = read_stored_tags(conn, names)
+        missing = [name for name in names if name not in tags]
+        logging.info(f'{len(names)} unique artists, {len(missing)} not in the tag store')
+        if state is not None:
+            retried = len(set(state.pending_tags()).intersection(missing))
+            if retried:
+                logging.info('%s of them failed on the last run and are tried again', retried)
+            state.set_pending_tags(missing)
+
+        # displays a progress bar
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(total=len(missing)) as progress:
+            for i in range(0, len(missing), batch_size):
+                batch = missing[i:i + batch_size]
+                fetched = dict(zip(batch, executor.map(get_ArtistTags, batch)))
+                progress.update(len(batch))
+
+                # failed lookups come back as None and are left out so the next run retries them
+                found = [(name, tag) for name, tag in fetched.items() if tag is not None]
+                conn.executemany('INSERT OR REPLACE INTO artist_tags (name, tags) VALUES (?, ?)', found)
+                conn.commit()
+                if state is not None:
+                    state.remove_pending_tags([name for name, _ in found])
+                tags.update(fetched)
+
+        if state is not None:
+            failed = state.pending_tags()
+            if failed:
+                logging.warning('%s artists still without tags', len(failed))
+                print(f'{len(failed)} artists still have no tags, run export again to retry them')
+    finally:
+        conn.close()
+
+    # join the tags back on in one merge instead of a lookup per row
+    # the same few tag strings repeat over and over, a categorical stores each once
+    tag_frame = pd.DataFrame({
+        'name': pd.array(list(tags), dtype=artists['name'].dtype),
+        'tags': pd.Series(list(tags.values()), dtype='category'),
+    })
+    return artists.drop(columns='tags', errors='ignore').merge(tag_frame, on='name', how='left')
+
+def convertAndExport(artists, top=None, csv_path='artists.csv', parquet_path='artists.parquet'):
+    '''sort artists by listeners and save them to artists.csv and artists.parquet
+    params: artists = dataframe, or the path written by stream_Paginated
+            top = only keep the top artists by listeners
+            parquet_path = also write a Parquet file (needs pyarrow), None to skip it
+    '''
+    if isinstance(artists, str):
+        artists = read_pages(artists).drop_duplicates()
+
+    # already numeric when built by this module, only frames from elsewhere are converted
+    artists = compact_artists(artists)
+
+    if top:
+        # picks the top rows without sorting the whole table
+        artists = artists.nlargest(top, 'listeners')
+    else:
+        # sort by listeners
+        artists = artists.sort_values("listeners", ascending=False)
+
+    logging.info('%s artists, %.1f MB in memory', len(artists), artists.memory_usage(deep=True).sum() / 2 ** 20)
+    logging.info('%s', artists.head(10))
+
+    artists.to_csv(csv_path, index=False)
+    if parquet_path:
+        # keeps the dtypes, and reads back far faster than the CSV
+        artists.to_parquet(parquet_path, index=False)
     logging.info('File Saved')
 
 def get_ArtistTags(artist_name):
@@ -165,17 +514,18 @@ def get_ArtistTags(artist_name):
         'artist': artist_name
     }
 
-    response = lastfm_get(payload)
+    try:
+        response = lastfm_get(payload)
+    except requests.RequestException as err:
+        # a timeout or connection error only loses this artist, the next run retries it
+        logging.warning('Tags for %s failed: %s', artist_name, err)
+        return None
 
     # if there's an error, just return nothing
-    if response.status_code != 200:
+    if response is None:
         logging.error('Error getting tags')
         return None
 
-    # rate limiting
-    if not getattr(response, 'from_cache', False):
-        time.sleep(0.25)
-
     # extract the top three tags and turn them into a string
     try:
         tags = [tag['name'] for tag in response.json()['toptags']['tag'][:3]]
@@ -195,16 +545,25 @@ def lastfm_get(payload):
     Returns: Response object
     '''
 
-    # Define headers and URL
+    # Define headers
     myHeaders = {'user-agent': USER_AGENT}
-    URL = r'http://ws.audioscrobbler.com/2.0/'
 
     # Add API key and format to the payload
     payload['api_key'] = API_KEY
     payload['format'] = 'json'
 
-    response = requests.get(URL, headers=myHeaders, params=payload, timeout=3.5)
-    logging.debug(f'Status: {response.status_code}')
+    # rate limiting, wait for a token from the shared bucket
+    RATE_LIMITER.acquire()
+
+    # goes through the shared keep-alive session instead of a new connection per call
+    # no retries inside http_client: they wouldn't take a token, fetch_page retries through here instead
+    response = http_client.get(API_URL, headers=myHeaders, params=payload, timeout=3.5, retry_statuses=False)
+
+    # responses read from the cache never reached last.fm, so give the token back
+    if getattr(response, 'from_cache', False):
+        RATE_LIMITER.refund()
+
+    logging.debug('last.fm response', extra={'method': payload['method'], 'status': response.status_code})
 
     # if there's an error, just return nothing
     if response.status_code != 200:
@@ -218,8 +577,87 @@ def jprint(obj):
     '''
     return json.dumps(obj, sort_keys=True, indent=2)
 
+def main(argv=None):
+    '''command line entry point, run with --help for the commands
+    pandas and tqdm are only imported by the commands that build dataframes'''
+    # options every command takes
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--cache', default='http_cache.sqlite', help='on-disk http cache, artist tags stay fresh for a week')
+    common.add_argument('--no-cache', action='store_true', help='send every request to last.fm')
+    common.add_argument('--metrics', default='http_metrics.json', help='file for the request metrics, .prom for Prometheus text')
+    common.add_argument('--metrics-port', type=int, help='serve the metrics at http://127.0.0.1:PORT/metrics while running')
+    common.add_argument('--log-file', default=f'{__file__}.log', help='one JSON record per line, written from a background thread')
+    common.add_argument('--log-sample', type=float, default=PAYLOAD_SETTINGS['sample_rate'],
+                        help='share of the response bodies written to the log')
+    common.add_argument('--http-debug', action='store_true', help='print the HTTP headers of every request to stdout')
+
+    parser = argparse.ArgumentParser(description='Last.fm top artists chart tools, crawl is the default command')
+    commands = parser.add_subparsers(dest='command')
+
+    crawl = commands.add_parser('crawl', parents=[common], help='pull the chart, tag the artists and save them to artists.csv')
+    crawl.add_argument('--resume', action='store_true', help='continue the crawl recorded in the state file')
+    crawl.add_argument('--pages', type=int, default=5, help='number of pages to request')
+    crawl.add_argument('--workers', type=int, default=4, help='number of concurrent requests')
+    crawl.add_argument('--output', default='artists_pages', help='a .csv file or a directory for Parquet files')
+    crawl.add_argument('--top', type=int, help='only export the top artists by listeners')
+
+    export = commands.add_parser('export', parents=[common], help='tag the pages saved by crawl and save them to artists.csv')
+    export.add_argument('path', nargs='?', default='artists_pages', help='the --output of crawl')
+    export.add_argument('--top', type=int, help='only export the top artists by listeners')
+
+    commands.add_parser('pages', parents=[common], help='print the number of pages in the chart')
+
+    tags = commands.add_parser('tags', parents=[common], help='print the top tags of artists')
+    tags.add_argument('artists', nargs='+')
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # without a command, crawl, as the script did before it had commands
+    if not argv or (argv[0] not in commands.choices and argv[0] not in ('-h', '--help')):
+        argv.insert(0, 'crawl')
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_file, sample_rate=args.log_sample)
+    if args.http_debug:
+        # Changing the logging debug level greater than 0 will log the response HTTP headers to stdout.
+        # useful if you're dealing with an API that returns a large body payload that is not suitable for logging or contains binary content.
+        http.client.HTTPConnection.debuglevel = 1
+
+    if not args.no_cache:
+        http_client.install_cache(args.cache)
+    if args.metrics_port:
+        http_metrics.serve(args.metrics_port)
+
+    try:
+        if args.command == 'crawl':
+            #get_TopArtists()  # Successful
+
+            # In memory version
+            #responses = get_Paginated(workers=4)  # Successful
+            #df = process_responses(responses)  # Successful
+            #convertAndExport(df)  # Successful
+
+            # Streaming version with checkpoints, pages go straight to disk instead of being held in memory
+            try:
+                path = stream_Paginated(args.output, args.pages, args.workers, resume=args.resume)
+            except FileExistsError as err:
+                parser.exit(1, f'{err}\n')
+            if path is not None:
+                df = process_artists(read_pages(path), state_path=CRAWL_STATE)
+                convertAndExport(df, top=args.top)
+
+        elif args.command == 'export':
+            df = process_artists(read_pages(args.path), state_path=CRAWL_STATE)
+            convertAndExport(df, top=args.top)
+
+        elif args.command == 'pages':
+            get_TopArtists()
+
+        elif args.command == 'tags':
+            for name in args.artists:
+                print(f'{name}: {get_ArtistTags(name)}')
+    finally:
+        # where the time went, per Last.fm method
+        http_metrics.METRICS.dump(args.metrics)
+
 if __name__ == "__main__":
-    #get_TopArtists()  # Successful
-    responses = get_Paginated()  # Successful
-    df = process_responses(responses)  # Successful
-    convertAndExport(df)  # Successful
+    main()
@@ -1,38 +1,58 @@
 # Accessing the different endpoints offered by the open-notify api
 
-import requests
 import json
 import http
 import logging
 import datetime
-
-logging.basicConfig(filename=f'{__file__}.log', level=logging.DEBUG, filemode='w', format='%(name)s - %(levelname)s - %(message)s')
-
-# Changing the logging debug level greater than 0 will log the response HTTP headers to stdout.
-# useful if you're dealing with an API that returns a large body payload that is not suitable for logging or contains binary content.
-http.client.HTTPConnection.debuglevel = 1
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import http_client
+import http_metrics
+from log_setup import setup_logging, log_payload
+
+# Every endpoint lives under this url, point it somewhere else (e.g. benchmarks/fake_services.py) to run offline
+API_URL = 'http://api.open-notify.org'
+
+# Pass predictions keyed by (rounded lat, rounded lon, alt, n), each stored with the time window it was fetched in
+# Only the current window is kept, the entries of past windows are dropped when a new one starts
+PASS_CACHE = {}
+_pass_cache_lock = threading.Lock()
+_pass_cache_window = None
 
 # International Space Station Location
 # Documentation: http://open-notify.org/Open-Notify-API/ISS-Location-Now/
 # EndPoint: http://api.open-notify.org/iss-now.json
-def get_ISS_Position():
+def fetch_ISS_Position():
     '''
     Params: None
-    Returns: latitude and longitude of the space station and a unix timestamp for the time the location was valid.
+    Returns: (unix timestamp, latitude, longitude) of the space station, latitude and longitude as floats.
     '''
 
-    response = requests.get(r'http://api.open-notify.org/iss-now.json')  # Get request with no additional params
+    response = http_client.get(f'{API_URL}/iss-now.json')  # Get request with no additional params
+    # an error page isn't JSON, report the HTTP error instead of a decode error
+    response.raise_for_status()
 
-    logging.debug(f'Status: {response.status_code}')
-    logging.debug(f'Response: {jPrint(response.json())}')
+    # decode the body once and work from the parsed data
+    data = response.json()
 
-    epochTime = response.json()['timestamp']
-    timeStamp = datetime.datetime.fromtimestamp(epochTime)
+    # one JSON line, for a sample of the responses, encoded on the logging thread
+    log_payload('iss-now.json response', data, status=response.status_code)
+
+    position = data['iss_position']
+    return data['timestamp'], float(position['latitude']), float(position['longitude'])
+
+def get_ISS_Position():
+    '''
+    Params: None
+    Returns: latitude and longitude of the space station and a unix timestamp for the time the location was valid.
+    '''
 
-    issLatitude = response.json()['iss_position']['latitude']
-    issLongitude = response.json()['iss_position']['longitude']
+    epochTime, issLatitude, issLongitude = fetch_ISS_Position()
+    timeStamp = datetime.datetime.fromtimestamp(epochTime)
 
-    logging.info(f'\nTime: {str(timeStamp)}\n\tLatitude: {issLatitude}\n\tLongitude: {issLongitude}')
+    logging.info('ISS position at %s: latitude %s, longitude %s', timeStamp, issLatitude, issLongitude)
+    return epochTime, issLatitude, issLongitude
 
 # International Space Station pass times
 # Documentation: http://open-notify.org/Open-Notify-API/ISS-Pass-Times/
@@ -42,15 +62,10 @@ def get_ISS_Position():
 # lon = longitude > Accepted values range(-180,180)
 # alt = altitude > Accepted values range(0,10000)
 # n = number of passes > Accepted values range(1,100)
-def when_ISS_Overhead(latitude, longitude, altitude=1, number=1):
+def fetch_ISS_Passes(latitude, longitude, altitude=1, number=1):
     '''
-    This function will make an API call requesting a list of times the ISS will be overhead.
-    Required Parameters:
-        latitude - latitude(degrees) of the place to predict passes
-        longitude - longitude(degrees) of the place to predict passes
-    Optional Parameters:
-        altitude - The altitude(meters) of the place to predict passes defaults to 1
-        number - The number of passes to return defaults to 1
+    Make the API call for the ISS pass times over one place.
+    Returns: list of dictionaries with 'duration' and 'risetime' keys
     '''
     parameters = {
         'lat': latitude,
@@ -59,13 +74,26 @@ def when_ISS_Overhead(latitude, longitude, altitude=1, number=1):
         'n': number
     }
 
-    response = requests.get(r'http://api.open-notify.org/iss-pass.json', params=parameters)  # Get request with additional params
+    response = http_client.get(f'{API_URL}/iss-pass.json', params=parameters)  # Get request with additional params
+    response.raise_for_status()
+
+    data = response.json()
 
-    logging.debug(f'Status: {response.status_code}')
-    logging.debug(f'Response: {jPrint(response.json())}')
+    log_payload('iss-pass.json response', data, status=response.status_code)
 
-    pass_times = response.json()['response']  # extract the part of the response needed
+    return data['response']  # extract the part of the response needed
 
+def when_ISS_Overhead(latitude, longitude, altitude=1, number=1):
+    '''
+    This function will make an API call requesting a list of times the ISS will be overhead.
+    Required Parameters:
+        latitude - latitude(degrees) of the place to predict passes
+        longitude - longitude(degrees) of the place to predict passes
+    Optional Parameters:
+        altitude - The altitude(meters) of the place to predict passes defaults to 1
+        number - The number of passes to return defaults to 1
+    '''
+    pass_times = fetch_ISS_Passes(latitude, longitude, altitude, number)
 
     # pass_times is a list of dictionaries
     # each dictionary has a 'duration' key and a 'risetime' key
@@ -74,9 +102,90 @@ def when_ISS_Overhead(latitude, longitude, altitude=1, number=1):
 
         # we need to convert the epoch timestamps to something readable
         time = datetime.datetime.fromtimestamp(epochTime)
-        logging.debug(f'Time: {time}')
         print(f'The ISS will pass overhead on {time.date()} at {time.time()}')
-        logging.info(f'The ISS will pass overhead on {time.date()} at {time.time()}')
+        logging.info('The ISS will pass overhead on %s at %s', time.date(), time.time())
+
+def when_ISS_Overhead_bulk(coordinates, altitude=1, number=1, workers=8, precision=2, cache_window=3600):
+    '''
+    Pass predictions for many places at once.
+    All inputs are range checked as arrays before any request is sent.
+    Coordinates are rounded to 'precision' decimals, places that round to the same point share one request,
+    and results are cached for the rest of the current 'cache_window' seconds.
+    Required Parameters:
+        coordinates - sequence or array of (latitude, longitude) pairs
+    Optional Parameters:
+        altitude - meters, one value for every site or one per site, defaults to 1
+        number - passes per site, one value for every site or one per site, defaults to 1
+        workers - number of concurrent requests
+    Returns: DataFrame with one row per pass: site (index into coordinates), risetime (unix time), duration (seconds).
+        Sites whose request failed have no rows, their indices are listed in the frame's attrs['failed'],
+        so they can be told apart from sites without passes.
+    '''
+    # only the bulk lookup needs them, the one-shot calls (and iss_tracker) don't pay for the import
+    import numpy as np
+    import pandas as pd
+
+    coords = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    latitudes = np.round(coords[:, 0], precision)
+    longitudes = np.round(coords[:, 1], precision)
+    altitudes = np.broadcast_to(np.asarray(altitude, dtype=float), latitudes.shape)
+    numbers = np.broadcast_to(np.asarray(number, dtype=int), latitudes.shape)
+
+    # the same ranges the API accepts, see the query strings above
+    valid = ((np.abs(latitudes) <= 80) & (np.abs(longitudes) <= 180)
+             & (altitudes >= 0) & (altitudes <= 10000)
+             & (numbers >= 1) & (numbers <= 100))
+    if not valid.all():
+        bad_sites = np.flatnonzero(~valid)
+        raise ValueError(f'{len(bad_sites)} sites out of range, first ones: {bad_sites[:10].tolist()}')
+
+    keys = list(zip(latitudes.tolist(), longitudes.tolist(), altitudes.tolist(), numbers.tolist()))
+
+    # only request the points that aren't cached for the current window
+    global _pass_cache_window
+    window = int(time.time() // cache_window)
+    with _pass_cache_lock:
+        if window != _pass_cache_window:
+            # a long running process would otherwise keep every past window's sites forever
+            for key in [key for key, (fetched, _) in PASS_CACHE.items() if fetched != window]:
+                del PASS_CACHE[key]
+            _pass_cache_window = window
+        passes = {key: PASS_CACHE[key][1] for key in set(keys) if key in PASS_CACHE and PASS_CACHE[key][0] == window}
+    missing = [key for key in set(keys) if key not in passes]
+    logging.info('%s sites, %s requests needed', len(keys), len(missing))
+
+    def fetch(key):
+        try:
+            return fetch_ISS_Passes(*key)
+        except Exception as err:
+            logging.error('Pass times for %s failed: %s', key, err)
+            return None
+
+    failed = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for key, pass_times in zip(missing, executor.map(fetch, missing)):
+            if pass_times is None:
+                failed.add(key)
+                pass_times = []  # not cached so the next call tries again
+            else:
+                with _pass_cache_lock:
+                    PASS_CACHE[key] = (window, pass_times)
+            passes[key] = pass_times
+
+    # build the table column-wise instead of a dict per row
+    counts = np.fromiter((len(passes[key]) for key in keys), dtype=np.int64, count=len(keys))
+    risetimes = np.fromiter((pt['risetime'] for key in keys for pt in passes[key]), dtype=np.int64, count=counts.sum())
+    durations = np.fromiter((pt['duration'] for key in keys for pt in passes[key]), dtype=np.int64, count=counts.sum())
+
+    frame = pd.DataFrame({
+        'site': np.repeat(np.arange(len(keys)), counts),
+        'risetime': risetimes,
+        'duration': durations,
+    })
+    frame.attrs['failed'] = [site for site, key in enumerate(keys) if key in failed]
+    if failed:
+        logging.warning('%s of %s sites failed', len(frame.attrs['failed']), len(keys))
+    return frame
 
 # People in Space
 # Documentation: http://open-notify.org/Open-Notify-API/People-In-Space/
@@ -86,23 +195,25 @@ def get_Astronauts():
     This API takes no inputs.
     Returns: Number of people in space. When known it also returns the names and spacecraft those people are on.
     '''
-    response = requests.get(r'http://api.open-notify.org/astros.json')  # Get request with no additional params
-    logging.debug(f'Status: {response.status_code}')
-    logging.debug(f'{jPrint(response.json())}')  # View entire response
+    response = http_client.get(f'{API_URL}/astros.json')  # Get request with no additional params
+    response.raise_for_status()
+    data = response.json()
+
+    log_payload('astros.json response', data, status=response.status_code)  # View entire response
 
     # Extract number of astronauts
-    astro_count = response.json()['number']
+    astro_count = data['number']
     print(f'Number of astronauts in space: {astro_count}')
 
     # Extract list of dictionaries 'people'
     # Each dictionary has a 'name' key and 'craft' key
-    people = response.json()['people']
+    people = data['people']
 
     for person in people:
         name = person['name']
         craft = person['craft']
 
-        logging.info(f'{name} is currently in space aboard the {craft}')
+        logging.info('%s is currently in space aboard the %s', name, craft)
         print((f'{name} is currently in space aboard the {craft}'))
 
 
@@ -113,9 +224,20 @@ def jPrint(obj):
     return json.dumps(obj, sort_keys=True, indent=4)
 
 if __name__ == "__main__":
+    # the file is written from a background thread, every response body is logged for this short demo
+    setup_logging(f'{__file__}.log', sample_rate=1.0)
+
+    # Changing the logging debug level greater than 0 will log the response HTTP headers to stdout.
+    # useful if you're dealing with an API that returns a large body payload that is not suitable for logging or contains binary content.
+    http.client.HTTPConnection.debuglevel = 1
+
     logging.info('------------ISS Postion------------')
     get_ISS_Position()  # Successful!
     logging.info('------------ISS Overhead------------')
     when_ISS_Overhead(32.2123, -110.879, number=4)  # Successful!
+    logging.info('------------ISS Overhead, many places------------')
+    print(when_ISS_Overhead_bulk([(32.2123, -110.879), (51.5074, -0.1278), (-33.8688, 151.2093)], number=2))
     logging.info('------------Astronauts in space------------')
     get_Astronauts()  # Successful
+    logging.info('------------Request metrics------------')
+    logging.info('request metrics', extra={'metrics': http_metrics.METRICS.to_dict()})
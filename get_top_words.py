@@ -1,10 +1,15 @@
 # Python3 program for a word frequency
 # counter after crawling a web-page
-import requests
-from bs4 import BeautifulSoup
 import operator
 from collections import Counter
 import pprint
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from xml.etree import ElementTree
+import http_client
+from html_parsers import select_texts
+from word_counter import STRIP_SYMBOLS, count_words, top_words
 
 
 '''Function defining the web-crawler/core
@@ -14,43 +19,29 @@ the second function clean_wordlist()'''
 
 pp = pprint.PrettyPrinter(indent=2)
 
-def start(url):
+def start(url, parser=None):
 
-    # empty list to store the contents of
-    # the website fetched from our web-crawler
-    wordlist = []
-    source_code = requests.get(url).text
-
-    # BeautifulSoup object which will
-    # ping the requested url for data
-    soup = BeautifulSoup(source_code, 'html.parser')
+    source_code = http_client.get(url).text
 
     # Text in given web-page is stored under
     # the <div> tags with class <entry-content>
-    for each_text in soup.findAll('div', {'class': 'entry-content'}):
-        content = each_text.text
+    # parser picks the HTML parser backend, see html_parsers.py
+    texts = select_texts(source_code, 'div', 'entry-content', parser)
+
+    # lowercase, clean and count the words of every div in one pass
+    word_count = count_words(texts)
 
-        # use split() to break the sentence into
-        # words and convert them into lowercase
-        words = content.lower().split()
+    # To get the count of each word in the crawled page -->
+    all_words_count(word_count)
 
-        for each_word in words:
-            wordlist.append(each_word)
-        clean_wordlist(wordlist)
+    # To get most common words used -->
+    get_most_used_words(word_count)
 
 # Function removes any unwanted symbols
 
 
 def clean_wordlist(wordlist):
-    clean_list = []
-    for word in wordlist:
-        symbols = '!@#$%^&*()_-+={[}]|\;:"<>?/., '
-
-        for i in range(0, len(symbols)):
-            word = word.replace(symbols[i], '')
-
-        if len(word) > 0:
-            clean_list.append(word)
+    clean_list = [word for word in (w.translate(STRIP_SYMBOLS) for w in wordlist) if word]
     create_dictionary(clean_list)
 
 # Creates a dictionary conatining each word's
@@ -58,12 +49,7 @@ def clean_wordlist(wordlist):
 
 
 def create_dictionary(clean_list):
-    word_count = {}
-    for word in clean_list:
-        if word in word_count:
-            word_count[word] += 1
-        else:
-            word_count[word] = 1
+    word_count = Counter(clean_list)
 
     # To get the count of each word in the crawled page -->
     all_words_count(word_count)
@@ -72,21 +58,122 @@ def create_dictionary(clean_list):
     get_most_used_words(word_count)
 
 def all_words_count(word_count):
-    c = Counter(word_count)
-
-    pp.pprint(c.items())
+    pp.pprint(word_count.items())
     # sort the dictionary in ascending order of word frequency
     #for key, value in sorted(word_count.items(), key = operator.itemgetter(1)):
     #    print(f"{key}: {value}")
 
 def get_most_used_words(word_count):
-    c = Counter(word_count)
-
     # returns the most occurring elements
-    top = c.most_common(10)
+    top = top_words(word_count, 10)
     print(top)
 
 
+# Corpus mode: many pages at once
+# Pages are downloaded by a pool of threads (the work is waiting on the network)
+# and handed to a pool of processes for the HTML parse and counting (the work is CPU bound).
+# Each page comes back as its own Counter, they are merged into the corpus total as they finish.
+
+
+def count_page(html, parser=None):
+    '''parse one page and count the words of its entry-content divs
+    runs in a worker process, so it only takes and returns picklable values
+    Returns: Counter'''
+    return count_words(select_texts(html, 'div', 'entry-content', parser))
+
+
+def fetch_html(url):
+    '''Returns: the page source, or None if the request failed'''
+    try:
+        response = http_client.get(url)
+        response.raise_for_status()
+        return response.text
+    except Exception as err:
+        logging.error(f'{url}: {err}')
+        return None
+
+
+def read_sitemap(url):
+    '''collect the page urls listed in a sitemap.xml
+    sitemap index files are followed to the sitemaps they list
+    Returns: list of urls'''
+    root = ElementTree.fromstring(http_client.get(url).content)
+    locations = [element.text.strip() for element in root.iter() if element.tag.endswith('loc') and element.text]
+
+    if root.tag.endswith('sitemapindex'):
+        urls = []
+        for sitemap in locations:
+            urls.extend(read_sitemap(sitemap))
+        return urls
+    return locations
+
+
+def start_corpus(urls, top_n=10, fetch_workers=16, processes=None, parser=None):
+    '''count the words over many pages
+    params: urls = iterable of page urls
+            top_n = number of words to keep per page and for the corpus
+            fetch_workers = concurrent downloads
+            processes = parse/count worker processes, defaults to one per core
+            parser = HTML parser backend, see html_parsers.py
+    Returns: (corpus top_n list, dictionary of url -> page top_n list)'''
+    total = Counter()
+    per_page = {}
+    upcoming = iter(urls)
+    owners = {}  # future -> url
+
+    # pages being downloaded plus pages waiting for or in a worker process, the process pool's queue has
+    # no limit, so new downloads only start while this is below the cap and fetched pages can't pile up
+    max_pending = fetch_workers * 2
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetchers, ProcessPoolExecutor(max_workers=processes) as counters:
+
+        def fill():
+            while len(owners) < max_pending:
+                url = next(upcoming, None)
+                if url is None:
+                    return
+                owners[fetchers.submit(fetch_html, url)] = url
+
+        fill()
+        while owners:
+            done, _ = wait(owners, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = owners.pop(future)
+                try:
+                    result = future.result()
+                except Exception as err:
+                    # a page that fails to parse is skipped, like one that fails to download
+                    logging.error('%s: %s', url, err)
+                    continue
+
+                if isinstance(result, Counter):
+                    # reduce: merge the page counts into the corpus counts
+                    total.update(result)
+                    per_page[url] = top_words(result, top_n)
+                elif result is not None:
+                    # a download finished, send the page to a worker process
+                    owners[counters.submit(count_page, result, parser)] = url
+            fill()
+
+    return top_words(total, top_n), per_page
+
+
 # Driver code
 if __name__ == '__main__':
-    start("https://www.geeksforgeeks.org/programming-language-choose/")
+    parser = argparse.ArgumentParser(description='Count the most used words of one page, or of many pages')
+    parser.add_argument('urls', nargs='*', default=["https://www.geeksforgeeks.org/programming-language-choose/"])
+    parser.add_argument('--sitemap', help='read the page urls from a sitemap.xml')
+    parser.add_argument('--top', type=int, default=10, help='number of words to show')
+    parser.add_argument('--parser', default=None, help='HTML parser backend: auto, selectolax, lxml, html.parser or html5lib')
+    args = parser.parse_args()
+
+    # re-runs revalidate unchanged pages instead of downloading them again
+    http_client.install_cache()
+
+    if args.sitemap or len(args.urls) > 1:
+        urls = read_sitemap(args.sitemap) if args.sitemap else args.urls
+        corpus_top, page_tops = start_corpus(urls, top_n=args.top, parser=args.parser)
+        pp.pprint(page_tops)
+        print(corpus_top)
+    else:
+        start(args.urls[0], parser=args.parser)
@@ -0,0 +1,96 @@
+# html_parsers.py - pick the HTML parser backend for get_top_words and metadata_scraper
+
+# BeautifulSoup can sit on top of several tree builders, from fastest to slowest:
+#   lxml - C library, needs the lxml package
+#   html.parser - pure Python, always available
+#   html5lib - parses exactly like a browser, needs the html5lib package
+# selectolax (lexbor) is a separate, much faster C parser with its own API. It is used where the
+# code only needs text out of CSS-selected elements (the word counters), anything that needs a soup
+# falls back to the fastest BeautifulSoup builder.
+#
+# The backend is chosen with the HTML_PARSER environment variable or the parser= arguments,
+# 'auto' picks the fastest one installed. Run benchmarks/bench_parsers.py to compare them.
+#
+# Nothing is imported until a page is parsed: importing bs4 registers its builders, which imports lxml,
+# so a process that never parses (bulk_scraper's parent) doesn't pay for any of them.
+
+import functools
+import importlib.util
+import logging
+import os
+
+SOUP_BACKENDS = ('lxml', 'html.parser', 'html5lib')
+TEXT_BACKENDS = ('selectolax',) + SOUP_BACKENDS
+
+DEFAULT_BACKEND = os.environ.get('HTML_PARSER', 'auto')
+
+# the module each backend needs, html.parser comes with Python
+BACKEND_MODULES = {
+    'selectolax': 'selectolax.lexbor',
+    'lxml': 'lxml',
+    'html.parser': None,
+    'html5lib': 'html5lib',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def is_available(backend):
+    '''checked by looking the module up, without importing it'''
+    if backend not in BACKEND_MODULES:
+        return False
+    module = BACKEND_MODULES[backend]
+    try:
+        return module is None or importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:
+        # the parent package of a dotted name is missing
+        return False
+
+
+def lexbor_parser(markup):
+    '''Returns: selectolax LexborHTMLParser tree of markup'''
+    from selectolax.lexbor import LexborHTMLParser
+    return LexborHTMLParser(markup)
+
+
+def available_backends():
+    '''Returns: the installed backends, fastest first'''
+    return [backend for backend in TEXT_BACKENDS if is_available(backend)]
+
+
+def soup_backend(backend=None):
+    '''the BeautifulSoup builder to use for backend
+    'auto', selectolax and anything not installed fall back to the fastest installed builder
+    Returns: builder name
+    '''
+    backend = backend or DEFAULT_BACKEND
+    if backend in SOUP_BACKENDS and is_available(backend):
+        return backend
+    if backend not in ('auto', 'selectolax'):
+        logging.warning(f'HTML parser {backend!r} is not available, falling back')
+    return next(name for name in SOUP_BACKENDS if is_available(name))
+
+
+def make_soup(markup, backend=None, parse_only=None):
+    '''Returns: BeautifulSoup of markup built with the chosen backend'''
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(markup, soup_backend(backend), parse_only=parse_only)
+
+
+def text_backend(backend=None):
+    '''like soup_backend, but selectolax is allowed and preferred by 'auto'
+    Returns: backend name'''
+    backend = backend or DEFAULT_BACKEND
+    if backend in ('auto', 'selectolax') and is_available('selectolax'):
+        return 'selectolax'
+    return soup_backend(backend)
+
+
+def select_texts(markup, tag, class_name, backend=None):
+    '''the text of every <tag class="class_name"> element
+    Returns: list of strings'''
+    backend = text_backend(backend)
+    if backend == 'selectolax':
+        return [node.text() for node in lexbor_parser(markup).css(f'{tag}.{class_name}')]
+
+    soup = make_soup(markup, backend)
+    return [element.text for element in soup.find_all(tag, {'class': class_name})]
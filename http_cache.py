@@ -0,0 +1,187 @@
+# http_cache.py - on-disk HTTP cache with revalidation and a size cap, used by http_client
+
+# Responses are stored in SQLite together with their validators (ETag / Last-Modified).
+# A fresh entry is answered straight from disk. A stale entry is revalidated:
+# the request goes out with If-None-Match / If-Modified-Since, and a 304 means the stored body is still good,
+# so only headers cross the network.
+# How long an entry stays fresh depends on the endpoint, see DEFAULT_TTLS.
+# When the stored bodies grow past max_bytes the least recently used entries are deleted.
+
+import json
+import sqlite3
+import threading
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# (text found in the url, seconds fresh), first match wins, compared in lowercase
+DEFAULT_TTLS = [
+    ('iss-now.json', 1),  # the position changes every second
+    ('iss-pass.json', 15 * 60),
+    ('astros.json', 60 * 60),
+    ('method=artist.gettoptags', 7 * 24 * 60 * 60),  # an artist's tags barely change
+    ('method=chart.gettopartists', 24 * 60 * 60),
+]
+DEFAULT_TTL = 60 * 60
+
+
+class HttpCache:
+    '''SQLite backed HTTP cache.
+    Params:
+        path - the SQLite file
+        max_bytes - total size of the stored bodies before old entries are evicted
+        ttls - list of (url text, seconds) rules, defaults to DEFAULT_TTLS
+        default_ttl - seconds fresh for urls no rule matches
+    '''
+
+    def __init__(self, path='http_cache.sqlite', max_bytes=256 * 1024 * 1024, ttls=None, default_ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = [(text.lower(), seconds) for text, seconds in (DEFAULT_TTLS if ttls is None else ttls)]
+        self.default_ttl = default_ttl
+        self.counters = {'hits': 0, 'misses': 0, 'revalidations': 0, 'stores': 0, 'evictions': 0}
+
+        # one connection shared by every thread, guarded by the lock
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status INTEGER,
+                headers TEXT,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL,
+                last_access REAL,
+                size INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+        ''')
+        self._total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def ttl_for(self, url):
+        '''Returns: seconds a response for url stays fresh'''
+        url = url.lower()
+        for text, seconds in self.ttls:
+            if text in url:
+                return seconds
+        return self.default_ttl
+
+    def stats(self):
+        '''Returns: dictionary of the counters plus the number and size of stored entries'''
+        with self._lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return dict(self.counters, entries=entries, bytes=self._total_bytes)
+
+    def get(self, session, url, params=None, headers=None, **kwargs):
+        '''Send a GET through session, answering from the cache when possible.
+        Responses from the cache have from_cache = True,
+        responses confirmed by a 304 have revalidated = True.
+        Returns: Response object
+        '''
+        key = requests.Request('GET', url, params=params).prepare().url
+        now = time.time()
+        entry = self._load(key)
+
+        if entry is not None and entry['expires_at'] > now:
+            self._count('hits')
+            self._touch(key, now)
+            return self._build_response(key, entry, from_cache=True)
+
+        # stale or missing, ask the server, with the validators if we have any
+        conditional = dict(headers or {})
+        if entry is not None:
+            if entry['etag']:
+                conditional['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                conditional['If-Modified-Since'] = entry['last_modified']
+
+        response = session.get(url, params=params, headers=conditional, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            # unchanged, keep the stored body for another ttl
+            self._count('revalidations')
+            with self._lock, self.conn:
+                self.conn.execute('UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?',
+                                  (now + self.ttl_for(key), now, key))
+            revalidated = self._build_response(key, entry, from_cache=False)
+            revalidated.revalidated = True
+            return revalidated
+
+        self._count('misses')
+        if response.status_code == 200:
+            self._store(key, response, now)
+        return response
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _load(self, key):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT status, headers, body, etag, last_modified, expires_at FROM responses WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('status', 'headers', 'body', 'etag', 'last_modified', 'expires_at'), row))
+
+    def _touch(self, key, now):
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+
+    def _store(self, key, response, now):
+        body = response.content
+        size = len(body)
+        # a body bigger than a tenth of the cache would push out everything else
+        if size > self.max_bytes // 10:
+            return
+
+        with self._lock, self.conn:
+            old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, response.status_code, json.dumps(dict(response.headers)), body,
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                 now + self.ttl_for(key), now, size))
+            self._total_bytes += size - (old[0] if old else 0)
+            self.counters['stores'] += 1
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # must be called with the lock held, inside a transaction
+        # remove least recently used entries until we are back under 90% of the cap
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute('SELECT key, size FROM responses ORDER BY last_access')
+        doomed = []
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            doomed.append((key,))
+            self._total_bytes -= size
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', doomed)
+        self.counters['evictions'] += len(doomed)
+
+    def _build_response(self, key, entry, from_cache):
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(json.loads(entry['headers']))
+        response._content = entry['body']
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = key
+        response.reason = 'OK'
+        response.from_cache = from_cache
+        return response
+
+    def clear(self):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM responses')
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,183 @@
+# http_client.py - one pooled, keep-alive HTTP session shared by every client module
+
+# A bare requests.get() builds a throwaway Session for every call, so each request pays for a new
+# TCP (and TLS) handshake. A Session keeps a urllib3 connection pool per host, and the connections
+# stay open (keep-alive) between requests, so only the first request to a host pays for the setup.
+
+# The session is created lazily on first use.
+# install_cache() puts an on-disk HttpCache (see http_cache.py) in front of it.
+# Every request is timed and counted per endpoint in http_metrics.METRICS (see http_metrics.py).
+
+import json
+import threading
+import requests
+from urllib3.util.retry import Retry
+from http_cache import HttpCache
+from http_metrics import METRICS, TimedAdapter, endpoint_name
+
+# Defaults, change them with configure()
+SETTINGS = {
+    'pool_connections': 10,  # number of hosts to keep a connection pool for
+    'pool_maxsize': 10,  # connections kept alive per host, should be >= the number of worker threads
+    'retries': 3,  # retries on connection errors and on the status codes below
+    'backoff_factor': 0.5,  # sleep 0.5s, 1s, 2s... between retries
+    'retry_statuses': (429, 500, 502, 503, 504),
+    'timeout': 3.5,  # seconds, used when the caller doesn't pass one
+    'headers': {'User-Agent': 'API-Requests-Practice'},
+}
+
+_sessions = {}  # retry_statuses -> Session
+_cache = None
+_lock = threading.Lock()
+
+# Use the fastest JSON decoder that is installed, they all accept the raw bytes of the body
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+    except ImportError:
+        json_loads = json.loads
+
+_UNSET = object()
+
+
+class ApiResponse:
+    '''Wraps a requests.Response so the body is decoded at most once.
+    json() parses on the first call and returns the cached result after that,
+    everything else (status_code, text, headers, from_cache...) comes from the wrapped Response.
+    '''
+
+    def __init__(self, response):
+        self.response = response
+        self._json = _UNSET
+
+    def json(self):
+        if self._json is _UNSET:
+            self._json = json_loads(self.response.content)
+        return self._json
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def __bool__(self):
+        # a Response is falsy for 4xx/5xx status codes, keep that behaviour
+        return bool(self.response)
+
+    def __repr__(self):
+        return f'<ApiResponse [{self.response.status_code}]>'
+
+
+def configure(**settings):
+    '''Change the pool size, retries, timeout or default headers.
+    Takes effect for the next request, the current session (and its pools) is closed.
+    Example: configure(pool_maxsize=32, retries=5)
+    '''
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f'Unknown http_client settings: {", ".join(sorted(unknown))}')
+
+    with _lock:
+        SETTINGS.update(settings)
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def install_cache(path='http_cache.sqlite', **options):
+    '''Answer GET requests from an on-disk HttpCache from now on.
+    options are passed to HttpCache (max_bytes, ttls, default_ttl).
+    Returns: the HttpCache
+    '''
+    global _cache
+
+    with _lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = HttpCache(path, **options)
+        return _cache
+
+
+def uninstall_cache():
+    global _cache
+
+    with _lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+
+
+def cache_stats():
+    '''Returns: hit/miss/revalidation counters of the installed cache, or None without one'''
+    return _cache.stats() if _cache is not None else None
+
+
+def build_session(retry_statuses=True):
+    '''Create a Session with pooled adapters, retries with back-off and the default headers
+    params: retry_statuses = also retry read errors and SETTINGS['retry_statuses'] answers,
+            False only retries connection errors, so a request that reached the server is never sent twice
+    Returns: requests.Session
+    '''
+    retry = Retry(
+        total=SETTINGS['retries'],
+        read=None if retry_statuses else 0,
+        backoff_factor=SETTINGS['backoff_factor'],
+        status_forcelist=SETTINGS['retry_statuses'] if retry_statuses else (),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,  # hand the last response back instead of raising
+    )
+    # a plain HTTPAdapter whose connections report their connect time and bytes to http_metrics
+    adapter = TimedAdapter(
+        pool_connections=SETTINGS['pool_connections'],
+        pool_maxsize=SETTINGS['pool_maxsize'],
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(SETTINGS['headers'])
+    return session
+
+
+def get_session(retry_statuses=True):
+    '''Returns: the shared Session, building it on first use'''
+    with _lock:
+        if retry_statuses not in _sessions:
+            _sessions[retry_statuses] = build_session(retry_statuses)
+        return _sessions[retry_statuses]
+
+
+def get(url, params=None, headers=None, timeout=None, endpoint=None, retry_statuses=True, **kwargs):
+    '''Send a GET request through the shared session.
+    headers are merged over the session's default headers,
+    timeout falls back to SETTINGS['timeout'],
+    endpoint names the request in METRICS, by default host + path (+ the method parameter),
+    retry_statuses=False hands 429/5xx answers and read errors straight back, for callers that
+    retry on their own under a rate limit, where every attempt has to take a token.
+    Returns: ApiResponse wrapping the Response object
+    '''
+    if timeout is None:
+        timeout = SETTINGS['timeout']
+    if endpoint is None:
+        endpoint = endpoint_name(url, params)
+
+    session = get_session(retry_statuses)
+    cache = _cache
+
+    # streamed downloads (e.g. images) are read piece by piece and never cached
+    cached = cache is not None and not kwargs.get('stream')
+
+    started = METRICS.start()
+    try:
+        if cached:
+            response = cache.get(session, url, params=params, headers=headers, timeout=timeout, **kwargs)
+        else:
+            response = session.get(url, params=params, headers=headers, timeout=timeout, **kwargs)
+    except Exception as err:
+        METRICS.observe(endpoint, started, error=err)
+        raise
+    METRICS.observe(endpoint, started, response=response, cached=cached)
+    return ApiResponse(response)
@@ -0,0 +1,351 @@
+# http_metrics.py - latency histograms and counters for every request sent through http_client
+
+# Each http_client.get() is recorded under an endpoint name: host + path, plus the method parameter
+# for Last.fm style APIs (ws.audioscrobbler.com/2.0/?method=artist.gettoptags), so every page of a
+# scrape or every artist of a crawl lands on a handful of series instead of one per url.
+#
+# Per request:
+#   connect - opening a new connection: DNS lookup, TCP and TLS handshakes. urllib3 resolves and
+#             connects in one call so the DNS time is part of it. Reused keep-alive connections add nothing.
+#   ttfb - from sending the request until the response headers arrived, connect and retries included
+#   total - the whole http_client.get() call, body download and cache lookups included
+#   bytes sent (request line, headers and body as written to the socket) and received (body off the wire),
+#   cache hit / miss / revalidated (only while a cache is installed), retries made by urllib3,
+#   status class or the exception raised.
+#
+# The latencies go into HDR-style histograms: log-linear buckets with under 2% error at any scale,
+# so a 2ms cache revalidation and a 20s timeout are both measured precisely in constant memory.
+#
+# METRICS.to_json() / METRICS.to_prometheus() dump everything, METRICS.dump(path) writes either
+# (.prom or .txt for Prometheus text, anything else JSON), serve() exposes /metrics for a Prometheus scraper.
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+PHASES = ('connect', 'ttfb', 'total')
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# timings and byte counts of the request in progress on this thread, filled in by the connection
+# and adapter classes below and collected by Metrics.observe()
+_local = threading.local()
+
+
+class Histogram:
+    '''HDR-style latency histogram.
+    Values are kept in microseconds, every power of two is split into SUB_BUCKETS linear buckets,
+    so a recorded value is off by at most 1/HALF of itself whatever its size.
+    '''
+
+    SUB_BITS = 7
+    SUB_BUCKETS = 1 << SUB_BITS
+    HALF = SUB_BUCKETS // 2
+
+    def __init__(self):
+        self.counts = {}  # bucket index -> count, only the buckets in use
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def _index(cls, micros):
+        shift = max(micros.bit_length() - cls.SUB_BITS, 0)
+        return shift * cls.HALF + (micros >> shift)
+
+    @classmethod
+    def _upper_bound(cls, index):
+        # largest value in micros that falls into the bucket
+        shift = max(index // cls.HALF - 1, 0)
+        sub = index - shift * cls.HALF
+        return ((sub + 1) << shift) - 1
+
+    def record(self, seconds):
+        index = self._index(max(int(seconds * 1e6), 0))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, q):
+        '''Returns: seconds, the value below which a fraction q of the recordings fall'''
+        if not self.count:
+            return None
+        rank = max(int(q * self.count + 0.5), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._upper_bound(index) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'quantiles': {str(q): self.percentile(q) for q in QUANTILES},
+        }
+
+
+def _add_time(phase, seconds):
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+def _add_count(name, amount):
+    counts = getattr(_local, 'counts', None)
+    if counts is not None:
+        counts[name] = counts.get(name, 0) + amount
+
+
+class TimedConnectionMixin:
+    '''Times new connections and counts the bytes written to them'''
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _add_time('connect', time.perf_counter() - start)
+        _add_count('connections', 1)
+
+    def send(self, data):
+        # counted once written, a connection that can't be opened sends nothing
+        super().send(data)
+        _add_count('bytes_sent', len(data))
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    '''HTTPAdapter whose pools use the timed connections and which times the wait for the response headers'''
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+    def send(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().send(request, *args, **kwargs)
+        # requests reads the body later, so this is the time to the headers
+        _add_time('ttfb', time.perf_counter() - start)
+
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None:
+            _add_count('retries', len(retries.history))
+        return response
+
+
+def endpoint_name(url, params=None):
+    '''Returns: host + path of url, with ?method=... appended when the request has a method parameter'''
+    parts = urlsplit(url)
+    name = f'{parts.hostname or ""}{parts.path or "/"}'
+    method = (params or {}).get('method') if isinstance(params, dict) else None
+    if method:
+        name += f'?method={str(method).lower()}'
+    return name
+
+
+class EndpointStats:
+    '''Counters and latency histograms of one endpoint'''
+
+    COUNTERS = ('requests', 'errors', 'bytes_sent', 'bytes_received', 'connections', 'retries',
+                'cache_hits', 'cache_misses', 'cache_revalidated')
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.statuses = {}  # '2xx' / 'ConnectionError'... -> count
+        self.histograms = {phase: Histogram() for phase in PHASES}
+
+    def to_dict(self):
+        return {
+            'counters': dict(self.counters),
+            'statuses': dict(self.statuses),
+            'latency_seconds': {phase: histogram.to_dict() for phase, histogram in self.histograms.items()},
+        }
+
+
+class Metrics:
+    '''Registry of EndpointStats, one per endpoint name.
+    A host with more than max_paths_per_host distinct endpoints (a site being scraped page by page)
+    gets the rest folded into a single 'host/*' endpoint, so memory stays bounded.
+    '''
+
+    def __init__(self, max_paths_per_host=50):
+        self.max_paths_per_host = max_paths_per_host
+        self.started = time.time()
+        self._endpoints = {}
+        self._paths_per_host = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        '''Start recording a request made on this thread
+        Returns: perf_counter start time to pass to observe()'''
+        _local.timings = {}
+        _local.counts = {}
+        return time.perf_counter()
+
+    def _stats(self, endpoint):
+        # must be called with the lock held
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            host = endpoint.split('/', 1)[0]
+            if self._paths_per_host.get(host, 0) >= self.max_paths_per_host:
+                return self._stats_folded(host)
+            self._paths_per_host[host] = self._paths_per_host.get(host, 0) + 1
+            stats = self._endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def _stats_folded(self, host):
+        endpoint = f'{host}/*'
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = EndpointStats()
+        return self._endpoints[endpoint]
+
+    def observe(self, endpoint, started, response=None, error=None, cached=False):
+        '''Record the request started with start(), with its response or the exception it raised
+        cached = the request went through the http cache, only then is it counted as a hit, miss or revalidation'''
+        total = time.perf_counter() - started
+        timings = getattr(_local, 'timings', None) or {}
+        counts = getattr(_local, 'counts', None) or {}
+        _local.timings = _local.counts = None
+
+        if response is None or not cached:
+            cache = None
+        elif getattr(response, 'from_cache', False):
+            cache = 'cache_hits'
+        elif getattr(response, 'revalidated', False):
+            cache = 'cache_revalidated'
+        else:
+            cache = 'cache_misses'
+
+        if response is not None:
+            status = f'{response.status_code // 100}xx'
+            raw = getattr(response, 'raw', None)
+            # bytes off the wire (before decompression), nothing for answers from the cache
+            received = raw.tell() if raw is not None and hasattr(raw, 'tell') else 0
+        else:
+            status = type(error).__name__
+            received = 0
+
+        with self._lock:
+            stats = self._stats(endpoint)
+            counters = stats.counters
+            counters['requests'] += 1
+            if error is not None:
+                counters['errors'] += 1
+            if cache is not None:
+                counters[cache] += 1
+            counters['bytes_received'] += received
+            for name in ('bytes_sent', 'connections', 'retries'):
+                counters[name] += counts.get(name, 0)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+            if 'connect' in timings:
+                stats.histograms['connect'].record(timings['connect'])
+            if 'ttfb' in timings:
+                stats.histograms['ttfb'].record(timings['ttfb'])
+            stats.histograms['total'].record(total)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._paths_per_host.clear()
+            self.started = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'uptime_seconds': time.time() - self.started,
+                'endpoints': {endpoint: stats.to_dict() for endpoint, stats in sorted(self._endpoints.items())},
+            }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self, prefix='http_client'):
+        '''Returns: every counter and histogram in the Prometheus text exposition format,
+        the histograms as summaries with the QUANTILES'''
+        endpoints = self.to_dict()['endpoints']
+        lines = []
+
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        for name in EndpointStats.COUNTERS:
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            for endpoint, stats in endpoints.items():
+                lines.append(f'{prefix}_{name}_total{{endpoint="{label(endpoint)}"}} {stats["counters"][name]}')
+
+        lines.append(f'# TYPE {prefix}_responses_total counter')
+        for endpoint, stats in endpoints.items():
+            for status, count in sorted(stats['statuses'].items()):
+                lines.append(f'{prefix}_responses_total{{endpoint="{label(endpoint)}",status="{label(status)}"}} {count}')
+
+        lines.append(f'# TYPE {prefix}_request_seconds summary')
+        for endpoint, stats in endpoints.items():
+            for phase, histogram in stats['latency_seconds'].items():
+                labels = f'endpoint="{label(endpoint)}",phase="{phase}"'
+                for q, value in histogram['quantiles'].items():
+                    if value is not None:
+                        lines.append(f'{prefix}_request_seconds{{{labels},quantile="{q}"}} {value}')
+                lines.append(f'{prefix}_request_seconds_sum{{{labels}}} {histogram["sum"]}')
+                lines.append(f'{prefix}_request_seconds_count{{{labels}}} {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        '''write the metrics to path, Prometheus text for .prom / .txt files, JSON otherwise'''
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+
+METRICS = Metrics()
+
+
+def serve(port=9100, host='127.0.0.1', metrics=METRICS):
+    '''Expose the metrics at http://host:port/metrics from a background thread
+    Returns: the server, call shutdown() on it to stop'''
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') == '/metrics.json':
+                body, content_type = metrics.to_json().encode('utf-8'), 'application/json'
+            else:
+                body, content_type = metrics.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,178 @@
+# iss_tracker.py - long-running ISS position tracker built on fromOpenNotify
+
+# Polls iss-now.json on a fixed schedule with asyncio and keeps the samples in a ring buffer.
+# Each sample is three numbers in flat arrays (timestamp, latitude, longitude)
+# instead of a dict per sample, so a week of 1 second samples takes about 10 MB and never grows.
+
+# The schedule is anchored to the start time: tick n fires at start + n * interval,
+# so slow requests don't push the following ticks back.
+# A tick that would exceed max_in_flight requests is skipped rather than queued.
+
+import argparse
+import asyncio
+import datetime
+import logging
+from array import array
+from fromOpenNotify import fetch_ISS_Position
+
+
+class RingBuffer:
+    '''Fixed size, array-backed store of (timestamp, latitude, longitude) samples.
+    Once full the oldest sample is overwritten.
+    Timestamps are kept in increasing order, so time window queries are a binary search.
+    Params:
+        capacity - the number of samples kept
+    '''
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity  # unix timestamps
+        self.lats = array('f', [0.0]) * capacity  # 4 bytes is plenty for the 4 decimals the API returns
+        self.lons = array('f', [0.0]) * capacity
+        self._start = 0  # physical index of the oldest sample
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _index(self, i):
+        # logical position (0 = oldest) -> physical position in the arrays
+        return (self._start + i) % self.capacity
+
+    def append(self, timestamp, latitude, longitude):
+        '''add a sample
+        Returns: False if the sample is not newer than the last one and was dropped
+        '''
+        if self._size and timestamp <= self.times[self._index(self._size - 1)]:
+            return False
+
+        if self._size < self.capacity:
+            i = self._index(self._size)
+            self._size += 1
+        else:
+            # full, overwrite the oldest
+            i = self._start
+            self._start = (self._start + 1) % self.capacity
+
+        self.times[i] = timestamp
+        self.lats[i] = latitude
+        self.lons[i] = longitude
+        return True
+
+    def _first_at_or_after(self, timestamp):
+        # binary search over the logical positions
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._index(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def window(self, start=None, end=None):
+        '''samples with start <= timestamp <= end, oldest first
+        Returns: list of (timestamp, latitude, longitude)
+        '''
+        first = 0 if start is None else self._first_at_or_after(start)
+        samples = []
+        for position in range(first, self._size):
+            i = self._index(position)
+            if end is not None and self.times[i] > end:
+                break
+            samples.append((self.times[i], self.lats[i], self.lons[i]))
+        return samples
+
+    def latest(self):
+        '''Returns: the newest (timestamp, latitude, longitude) or None if empty'''
+        if not self._size:
+            return None
+        i = self._index(self._size - 1)
+        return self.times[i], self.lats[i], self.lons[i]
+
+
+class ISSTracker:
+    '''Samples the ISS position every interval seconds into a RingBuffer.
+    Params:
+        interval - seconds between samples
+        capacity - number of samples kept, defaults to one week at 1 second
+        max_in_flight - requests allowed to overlap when the API is slower than the interval
+    '''
+
+    def __init__(self, interval=1.0, capacity=7 * 24 * 3600, max_in_flight=2):
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.samples = RingBuffer(capacity)
+        self.errors = 0
+        self.skipped_ticks = 0
+        self._in_flight = 0
+
+    async def _sample(self):
+        self._in_flight += 1
+        try:
+            # the requests call blocks, so it runs in the default thread pool
+            timestamp, latitude, longitude = await asyncio.to_thread(fetch_ISS_Position)
+            self.samples.append(timestamp, latitude, longitude)
+        except Exception as err:
+            self.errors += 1
+            logging.warning('ISS position request failed: %s', err)
+        finally:
+            self._in_flight -= 1
+
+    async def run(self, duration=None):
+        '''poll until duration seconds have passed, or forever if duration is None'''
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tick = 0
+        tasks = set()
+
+        try:
+            while duration is None or tick * self.interval < duration:
+                if self._in_flight < self.max_in_flight:
+                    task = asyncio.create_task(self._sample())
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    self.skipped_ticks += 1
+
+                # sleep until the next tick of the fixed schedule,
+                # if we are already late skip the ticks we missed instead of firing them in a burst
+                tick += 1
+                now = loop.time()
+                behind = int((now - start) / self.interval) + 1 - tick
+                if behind > 0:
+                    self.skipped_ticks += behind
+                    tick += behind
+                await asyncio.sleep(start + tick * self.interval - now)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def ground_track(self, start=None, end=None):
+        '''the positions recorded between two unix timestamps
+        Returns: list of (timestamp, latitude, longitude), oldest first
+        '''
+        return self.samples.window(start, end)
+
+    def ground_track_last(self, seconds):
+        '''Returns: the positions recorded in the last 'seconds' seconds of the newest sample'''
+        latest = self.samples.latest()
+        if latest is None:
+            return []
+        return self.samples.window(latest[0] - seconds, latest[0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Track the ISS position on a fixed schedule')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between samples')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds to run for')
+    args = parser.parse_args()
+
+    tracker = ISSTracker(interval=args.interval)
+    asyncio.run(tracker.run(args.duration))
+
+    print(f'{len(tracker.samples)} samples, {tracker.errors} errors, {tracker.skipped_ticks} skipped ticks')
+    for timestamp, latitude, longitude in tracker.ground_track_last(10):
+        print(f'{datetime.datetime.fromtimestamp(timestamp)}  lat {latitude:.4f}  lon {longitude:.4f}')
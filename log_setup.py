@@ -0,0 +1,130 @@
+# log_setup.py - queued, one-line JSON logging for the API client scripts
+
+# logging.basicConfig(filename=...) writes every record to the file on the thread that logged it,
+# so each request thread waits on the disk, and a pretty-printed response body is a big write.
+# setup_logging() instead puts a QueueHandler on the root logger: logging a record only puts it on a queue,
+# and a QueueListener thread formats it and writes it to the file.
+# Records are formatted on the listener thread too (see DeferredQueueHandler), including the JSON
+# encoding of payloads, so the request threads never pay for it.
+#
+# Every record is one line of JSON: time, level, logger, message, plus any extra= fields.
+# Response bodies go through log_payload(): only a sample of them is logged (PAYLOAD_SETTINGS['sample_rate'])
+# and each is cut to PAYLOAD_SETTINGS['max_chars'] characters of compact JSON.
+
+import atexit
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+PAYLOAD_SETTINGS = {
+    'sample_rate': 0.1,  # share of the log_payload() calls that are logged
+    'max_chars': 2048,  # longest payload text kept, longer ones are cut and marked truncated
+}
+
+# attributes every LogRecord has, anything else on a record came from extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class Payload:
+    '''A JSON-able object that is only encoded when the record is written, to at most max_chars characters'''
+
+    def __init__(self, obj, max_chars=None):
+        self.obj = obj
+        self.max_chars = max_chars if max_chars is not None else PAYLOAD_SETTINGS['max_chars']
+
+    def encode(self):
+        '''Returns: (compact JSON text, True if it was cut)'''
+        # iterencode produces the text piece by piece, a huge body is only encoded up to the cap
+        pieces = []
+        length = 0
+        for piece in json.JSONEncoder(separators=(',', ':'), default=str).iterencode(self.obj):
+            pieces.append(piece)
+            length += len(piece)
+            if length > self.max_chars:
+                return ''.join(pieces)[:self.max_chars], True
+        return ''.join(pieces), False
+
+    def __str__(self):
+        text, truncated = self.encode()
+        return text + '...' if truncated else text
+
+
+class JsonFormatter(logging.Formatter):
+    '''Formats a record as one line of JSON'''
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name in _RECORD_ATTRIBUTES:
+                continue
+            if isinstance(value, Payload):
+                entry[name], truncated = value.encode()
+                if truncated:
+                    entry[f'{name}_truncated'] = True
+            else:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    '''QueueHandler that leaves the formatting to the listener thread.
+    The standard one formats the message before queueing it, on the logging thread.
+    The record keeps its arguments until it is written, so don't change an object after logging it,
+    which holds for the parsed response bodies the scripts log.
+    '''
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(filename, level=logging.DEBUG, filemode='w', sample_rate=None, max_chars=None):
+    '''Log to filename in one-line JSON records through a background thread.
+    Only the first call sets anything up, later calls return the same listener.
+    params: sample_rate, max_chars = override PAYLOAD_SETTINGS
+    Returns: the QueueListener, it is stopped (and the queue flushed) when the program exits
+    '''
+    global _listener
+
+    if sample_rate is not None:
+        PAYLOAD_SETTINGS['sample_rate'] = sample_rate
+    if max_chars is not None:
+        PAYLOAD_SETTINGS['max_chars'] = max_chars
+    if _listener is not None:
+        return _listener
+
+    file_handler = logging.FileHandler(filename, mode=filemode, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level)
+
+    _listener = QueueListener(records, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+def log_payload(message, payload, level=logging.DEBUG, logger=None, **fields):
+    '''Log a response body as a size capped payload field, for a sample of the calls.
+    fields are added to the record, e.g. log_payload('iss-now', data, status=200)
+    Returns: True if the record was logged
+    '''
+    logger = logger or logging.getLogger()
+    if not logger.isEnabledFor(level) or random.random() >= PAYLOAD_SETTINGS['sample_rate']:
+        return False
+    logger.log(level, message, extra=dict(fields, payload=Payload(payload)))
+    return True
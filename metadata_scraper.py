@@ -1,193 +1,446 @@
 """Scrape metadata from target URL."""
-import requests
-from bs4 import BeautifulSoup
-from collections import Counter
+# PIL is only imported when an image is actually inspected or downloaded, see LazyImage,
+# bs4 and the parser backends when a page is parsed, see html_parsers.py.
+import argparse
+import functools
+import sys
 import pprint
-from PIL import Image
 from io import BytesIO
-import lxml
-from urllib.parse import urljoin
-
-
-def scrape_page_metadata(url):
-    """Scrape target URL for metadata."""
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET',
-        'Access-Control-Allow-Headers': 'Content-Type',
-        'Access-Control-Max-Age': '3600',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64; rv:75.0) Gecko/20100101 Firefox/75.0'
-    }
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from hashlib import blake2b
+import http_client
+from html_parsers import make_soup
+from word_counter import count_words, top_words
+
+
+HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Max-Age': '3600',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64; rv:75.0) Gecko/20100101 Firefox/75.0'
+}
+
+
+@functools.lru_cache(maxsize=None)
+def head_tags():
+    """The SoupStrainer for the only tags parsed when the body isn't needed, built on first use."""
+    from bs4 import SoupStrainer
+    return SoupStrainer(['title', 'meta', 'link'])
 
+
+def scrape_page_metadata(url, links=True, words=True, parser=None):
+    """Scrape target URL for metadata.
+
+    Without links and words only the <title>, <meta> and <link> tags are parsed,
+    the body fallbacks (h1, p, img) then find nothing.
+    """
     pp = pprint.PrettyPrinter(indent=4)
 
-    r = requests.get(url, headers=headers)
-    soup = BeautifulSoup(r.content, 'lxml')
+    r = http_client.get(url, headers=HEADERS)
+    metadata = extract_metadata(r.content, url, links, words, parser)
+
+    pp.pprint(metadata)
+    return metadata
+
+
+def extract_metadata(content, url, links=True, words=True, parser=None):
+    """Parse page source and run every extractor on it."""
+    soup = parse_page(content, head_only=not (links or words), parser=parser)
+
+    # one pass over the <meta>/<link> tags, shared by every extractor
+    index = MetaIndex(soup)
+    image = get_image(soup, index)
 
     metadata = {
-        'title': get_title(soup),
-        'description': get_description(soup),
-        'image': get_image(soup),
-        'img': display_picture(get_image(soup)),
-        'favicon': get_favicon(soup, url),
-        'sitename': get_site_name(soup, url),
-        'color': get_theme_color(soup),
+        'title': get_title(soup, index),
+        'description': get_description(soup, index),
+        'image': image,
+        # nothing is downloaded until img.info() or img.load() is called
+        'img': LazyImage(urljoin(url, image)) if image else None,
+        'favicon': get_favicon(soup, url, index),
+        'sitename': get_site_name(soup, url, index),
+        'color': get_theme_color(soup, index),
         'url': url,
-        'links': get_all_site_links(soup, url),
-        'words': get_most_used_words(soup)
     }
-
-    pp.pprint(metadata)
+    if links:
+        metadata['links'] = get_all_site_links(soup, url)
+    if words:
+        metadata['words'] = get_most_used_words(soup)
     return metadata
 
 
-def get_title(soup):
+def extract_record(content, url, links=True, words=True, parser=None):
+    """Like extract_metadata, but only plain JSON types.
+
+    Safe to return from a worker process and to json.dumps:
+    BeautifulSoup strings and tags become str and the lazy image is left out.
+    """
+    metadata = extract_metadata(content, url, links, words, parser)
+    metadata.pop('img')
+    return to_plain(metadata)
+
+
+def to_plain(value):
+    """Convert parsed values to plain str/list/dict."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, dict):
+        return {str(key): to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    # str, NavigableString and Tag all end up as a plain str
+    return str(value)
+
+
+def parse_page(content, head_only=False, parser=None):
+    """Parse page source, optionally skipping everything but the head tags.
+
+    parser picks the BeautifulSoup backend, see html_parsers.py.
+    """
+    return make_soup(content, parser, parse_only=head_tags() if head_only else None)
+
+
+class MetaIndex:
+    """The page's <meta> and <link> tags, collected in a single traversal.
+
+    meta maps each property and name attribute to the tag's content,
+    links maps each rel value (and the full rel string, e.g. "shortcut icon") to the href.
+    The first tag wins, like soup.find() would.
+    """
+
+    def __init__(self, soup):
+        self.meta = {}
+        self.links = {}
+
+        for tag in soup.find_all(['meta', 'link']):
+            if tag.name == 'meta':
+                for key in (tag.get('property'), tag.get('name')):
+                    if key and key not in self.meta:
+                        self.meta[key] = tag.get('content')
+            else:
+                rel = tag.get('rel')
+                if not rel:
+                    continue
+                # BeautifulSoup splits rel into a list of values
+                if isinstance(rel, str):
+                    rel = rel.split()
+                for key in rel + [' '.join(rel)]:
+                    if key not in self.links:
+                        self.links[key] = tag.get('href')
+
+    def first_meta(self, *keys):
+        """Return (found, content) for the first key present."""
+        for key in keys:
+            if key in self.meta:
+                return True, self.meta[key]
+        return False, None
+
+
+def get_title(soup, index=None):
     """Scrape page title."""
-    title = None
+    index = index or MetaIndex(soup)
+
+    if soup.title and soup.title.string:
+        return soup.title.string
 
-    if soup.title.string:
-        title = soup.title.string
-    elif soup.find("meta", property="og:title"):
-        title = soup.find("meta", property="og:title").get('content')
-    elif soup.find("meta", property="twitter:title"):
-        title = soup.find("meta", property="twitter:title").get('content')
-    elif soup.find("h1"):
-        title = soup.find("h1").string
-    return title
+    found, title = index.first_meta("og:title", "twitter:title")
+    if found:
+        return title
+    heading = soup.find("h1")
+    if heading:
+        return heading.string
+    return None
 
 
-def get_description(soup):
+def get_description(soup, index=None):
     """Scrape page description."""
-    description = None
-
-    if soup.find("meta", property="description"):
-        description = soup.find("meta", property="description").get('content')
-    elif soup.find("meta", property="og:description"):
-        description = soup.find(
-            "meta", property="og:description").get('content')
-    elif soup.find("meta", property="twitter:description"):
-        description = soup.find(
-            "meta", property="twitter:description").get('content')
-    elif soup.find("p"):
-        description = soup.find("p").contents
-    return description
-
-
-def get_image(soup):
+    index = index or MetaIndex(soup)
+
+    found, description = index.first_meta("description", "og:description", "twitter:description")
+    if found:
+        return description
+
+    paragraph = soup.find("p")
+    if paragraph:
+        return paragraph.contents
+    return None
+
+
+def get_image(soup, index=None):
     """Scrape share image."""
-    image = None
+    index = index or MetaIndex(soup)
 
-    if soup.find("meta", property="image"):
-        image = soup.find("meta", property="image").get('content')
-    elif soup.find("meta", property="og:image"):
-        image = soup.find("meta", property="og:image").get('content')
-    elif soup.find("meta", property="twitter:image"):
-        image = soup.find("meta", property="twitter:image").get('content')
-    elif soup.find("img", src=True):
-        image = soup.find_all("img").get('src')
-    return image
+    found, image = index.first_meta("image", "og:image", "twitter:image")
+    if found:
+        return image
+
+    img = soup.find("img", src=True)
+    if img:
+        return img.get('src')
+    return None
 
 
-def get_site_name(soup, url):
+def get_site_name(soup, url, index=None):
     """Scrape site name."""
-    if soup.find("meta", property="og:site_name"):
-        site_name = soup.find("meta", property="og:site_name").get('content')
-    elif soup.find("meta", property='twitter:title'):
-        site_name = soup.find("meta", property="twitter:title").get('content')
-    else:
-        site_name = url.split('//')[1]
-        return site_name.split('/')[0].rsplit('.')[1].capitalize()
-    return site_name
+    index = index or MetaIndex(soup)
+
+    found, site_name = index.first_meta("og:site_name", "twitter:title")
+    if found:
+        return site_name
 
+    site_name = url.split('//')[1]
+    return site_name.split('/')[0].rsplit('.')[1].capitalize()
 
-def get_favicon(soup, url):
+
+def get_favicon(soup, url, index=None):
     """Scrape favicon."""
-    if soup.find("link", attrs={"rel": "icon"}):
-        favicon = soup.find("link", attrs={"rel": "icon"}).get('href')
-    elif soup.find("link", attrs={"rel": "shortcut icon"}):
-        favicon = soup.find("link", attrs={"rel": "shortcut icon"}).get('href')
-    else:
-        favicon = f'{url.rstrip("/")}/favicon.ico'
-    return favicon
+    index = index or MetaIndex(soup)
+
+    for rel in ("icon", "shortcut icon"):
+        if rel in index.links:
+            return index.links[rel]
+    return f'{url.rstrip("/")}/favicon.ico'
+
+
+class LazyImage:
+    """Share image that is only downloaded when asked for.
+
+    info() streams just the first bytes of the file, enough for PIL to read the format and size.
+    load() downloads the whole file, up to max_bytes, and decodes it.
+    """
+
+    def __init__(self, url, max_bytes=10 * 1024 * 1024):
+        self.url = url
+        self.max_bytes = max_bytes
+        self._info = None
+
+    def __repr__(self):
+        return f'LazyImage({self.url!r})'
+
+    def info(self, header_bytes=64 * 1024):
+        """Read the image format and dimensions from the start of the file.
+
+        Returns a dict with format, width and height, or None if they
+        weren't found in the first header_bytes bytes.
+        Raises requests.HTTPError if the server answers with an error status.
+        """
+        if self._info is not None:
+            return self._info
+
+        from PIL import ImageFile
+
+        parser = ImageFile.Parser()
+        response = http_client.get(self.url, headers=HEADERS, stream=True)
+        # raised before the try below, whose OSError would swallow it (HTTPError is an OSError)
+        if not response.ok:
+            response.close()
+            response.raise_for_status()
+        try:
+            received = 0
+            for chunk in response.iter_content(chunk_size=4096):
+                parser.feed(chunk)
+                received += len(chunk)
+                # the parser creates the image as soon as it has read the header
+                if parser.image or received >= header_bytes:
+                    break
+        except (OSError, SyntaxError):
+            # not an image format PIL understands
+            pass
+        finally:
+            response.close()
+
+        if parser.image:
+            self._info = {
+                'format': parser.image.format,
+                'width': parser.image.size[0],
+                'height': parser.image.size[1],
+            }
+        return self._info
+
+    def load(self, thumbnail=None):
+        """Download and decode the image.
+
+        thumbnail is an optional (width, height) to shrink the image to.
+        Raises ValueError if the file is larger than max_bytes,
+        requests.HTTPError if the server answers with an error status.
+        """
+        response = http_client.get(self.url, headers=HEADERS, stream=True)
+        try:
+            # an error page would only reach PIL as an UnidentifiedImageError
+            response.raise_for_status()
+            data = BytesIO()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                data.write(chunk)
+                if data.tell() > self.max_bytes:
+                    raise ValueError(f'{self.url} is larger than {self.max_bytes} bytes')
+        finally:
+            response.close()
+
+        from PIL import Image
+
+        data.seek(0)
+        img = Image.open(data)
+        img.load()
+        if thumbnail:
+            img.thumbnail(thumbnail)
+        return img
 
 
 def display_picture(image):
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET',
-        'Access-Control-Allow-Headers': 'Content-Type',
-        'Access-Control-Max-Age': '3600',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64; rv:75.0) Gecko/20100101 Firefox/75.0'
-    }
-    response = requests.get(image, headers=headers)
-    img = Image.open(BytesIO(response.content))
-    return img
+    """Download and decode an image."""
+    return LazyImage(image).load()
 
 
-def get_theme_color(soup):
+def get_theme_color(soup, index=None):
     """Scrape brand color."""
-    if soup.find("meta", property="theme-color"):
-        color = soup.find("meta", property="theme-color").get('content')
-        return color
-    return None
+    index = index or MetaIndex(soup)
+    return index.meta.get("theme-color")
 
 
-def get_all_site_links(soup, url):
-    """Scrape all anchors on page."""
-    page_links = {}
-
-    if len(soup.body.find_all("a")) >= 1:
-        for anchor in soup.body.find_all("a"):
-            # urls with no length are discarded
-            if len(anchor.text) >= 1 and page_links.get(anchor.text) is None:
-                # resolve relational Url to absolute Url
-                try:
-                    linkBuilder = urljoin(url, anchor.get('href'))
-                    page_links[anchor.text] = linkBuilder
-                except UnicodeError:
-                    continue
-            else:
-                continue
-    else:
-        return page_links
-    return page_links
+DEFAULT_PORTS = {'http': 80, 'https': 443}
 
-def get_most_used_words(soup):
-    wordlist = []
 
-    for each_text in soup.findAll('div', {'class': 'entry-content'}):
-        content = each_text.text
+def normalize_url(url):
+    """Normalize a URL so equivalent spellings compare equal.
+
+    Lowercases the scheme and host, drops the default port and the fragment,
+    and turns an empty path into '/'.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if ':' in netloc:
+        # IPv6 literal
+        netloc = f'[{netloc}]'
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    if parts.username:
+        userinfo = parts.username + (f':{parts.password}' if parts.password else '')
+        netloc = f'{userinfo}@{netloc}'
 
-        # use split() to break the sentence into
-        # words and convert them into lowercase
-        words = content.lower().split()
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
 
-        for each_word in words:
-            wordlist.append(each_word)
 
-    clean_list = []
+def url_key(url):
+    """64 bit hash of a URL, a set of these is much smaller than a set of the strings."""
+    return int.from_bytes(blake2b(url.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'big')
 
-    for word in wordlist:
-        symbols = '!@#$%^&*()_-+={[}]|\;:"<>?/., '
 
-        for i in range(0, len(symbols)):
-            word = word.replace(symbols[i], '')
+def iter_site_links(soup, url, seen=None):
+    """Yield (normalized url, anchor text) for every distinct http(s) link on the page.
 
-        if len(word) > 0:
-            clean_list.append(word)
+    Anchors are walked once, relative links are resolved against the base URL,
+    and each URL is yielded only the first time it is seen.
+    Pass a set as seen to dedupe across several pages.
+    """
+    if seen is None:
+        seen = set()
 
-    word_count = {}
+    base = urlsplit(url)
+    origin = f'{base.scheme}://{base.netloc}'
+    root = soup.body or soup
 
-    for word in clean_list:
-        if word in word_count:
-            word_count[word] += 1
-        else:
-            word_count[word] = 1
+    for anchor in root.find_all("a", href=True):
+        href = anchor['href'].strip()
+        if not href or href.startswith('#'):
+            continue
+
+        # resolve relational Url to absolute Url, the common cases without re-parsing the base
+        try:
+            if href.startswith(('http://', 'https://')):
+                link = href
+            elif href.startswith('/') and not href.startswith('//'):
+                link = origin + href
+            else:
+                link = urljoin(url, href)
+            link = normalize_url(link)
+        except (UnicodeError, ValueError):
+            continue
+
+        # skip mailto:, javascript:, tel: and friends
+        if not link.startswith(('http://', 'https://')):
+            continue
+
+        key = url_key(link)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield link, anchor.get_text(strip=True)
+
+
+def get_all_site_links(soup, url):
+    """Scrape all anchors on page.
+
+    Returns a dictionary of normalized url -> anchor text, one entry per distinct url.
+    Use iter_site_links to stream them instead.
+    """
+    return dict(iter_site_links(soup, url))
+
+
+def get_most_used_words(soup):
+    """Count the words of the page's entry-content divs."""
+    texts = (each_text.text for each_text in soup.findAll('div', {'class': 'entry-content'}))
 
-    c = Counter(word_count)
     # returns the most occurring elements
-    top = c.most_common(10)
+    top = top_words(count_words(texts), 10)
     return top
 
+def main(argv=None):
+    """Command line entry point, run with --help for the commands."""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('url', nargs='?', default=r'https://www.geeksforgeeks.org/python-programming-language/')
+    common.add_argument('--cache', default='http_cache.sqlite', help='on-disk http cache, re-runs revalidate unchanged pages')
+    common.add_argument('--no-cache', action='store_true', help='always download the page')
+
+    parser = argparse.ArgumentParser(description='Scrape metadata from web pages, metadata is the default command')
+    commands = parser.add_subparsers(dest='command')
+
+    metadata = commands.add_parser('metadata', parents=[common], help='print the title, description, image... of a page')
+    metadata.add_argument('--no-links', action='store_true', help='skip the page links')
+    metadata.add_argument('--no-words', action='store_true', help='skip the most used words')
+    metadata.add_argument('--parser', help='HTML parser backend, see html_parsers.py')
+
+    commands.add_parser('links', parents=[common], help='print the distinct links of a page')
+
+    image = commands.add_parser('image', parents=[common], help='print the format and size of the share image of a page')
+    image.add_argument('--show', action='store_true', help='download the image and open it')
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # without a command, scrape the metadata, as the script did before it had commands
+    if not argv or (argv[0] not in commands.choices and argv[0] not in ('-h', '--help')):
+        argv.insert(0, 'metadata')
+    args = parser.parse_args(argv)
+
+    if not args.no_cache:
+        http_client.install_cache(args.cache)
+
+    if args.command == 'metadata':
+        scrape_page_metadata(args.url, links=not args.no_links, words=not args.no_words, parser=args.parser)
+        return
+
+    response = http_client.get(args.url, headers=HEADERS)
+    response.raise_for_status()
+
+    if args.command == 'links':
+        for link, text in iter_site_links(parse_page(response.content), args.url):
+            print(f'{link}\t{text}')
+
+    elif args.command == 'image':
+        image = get_image(parse_page(response.content))
+        if image is None:
+            print('no share image found')
+            return
+        image = LazyImage(urljoin(args.url, image))
+        print(image.url, image.info())
+        if args.show:
+            image.load().show()
+
+
 if __name__ == "__main__":
-    scrape_page_metadata(r'https://www.geeksforgeeks.org/python-programming-language/')
+    main()
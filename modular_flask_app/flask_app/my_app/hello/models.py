@@ -1,10 +1,275 @@
-# /my_app/hello/models.py - has a non persistant key-value store
+# /my_app/hello/models.py - pluggable key-value store for the messages
 
-# We have used a very simple non-persistent in-memory key-value store for the demonstration of the model layout structure.
-# It is true that we could have written the dictionary for the MESSAGES hash map in views.py
-# but it's best practice to keep the model and view layers separate.
+# The views only talk to 'store', so the storage behind it can be swapped:
+#   MemoryStore - a dict guarded by a lock, fine for a single process (the old MESSAGES dict)
+#   SqliteStore - a SQLite file, shared by every gunicorn worker and kept across restarts
+# Both sit behind CachedStore, a read-through LRU cache, so hot keys are answered from memory.
+# Every message carries a version that goes up on each write, the cache uses it to never
+# replace a newer entry with an older one.
+# Versions start at 1 in every new store, so each store also has an epoch, a random token made when its
+# data is created: the same key and version only mean the same message within one epoch. The cache is dropped whenever the backend reports a
+# write from another connection, and a read that started before the drop isn't put back into it.
+#
+# Pick the backend with the HELLO_STORE environment variable:
+#   HELLO_STORE=memory (default)
+#   HELLO_STORE=sqlite:///messages.sqlite
 
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
+
+# Messages every new store starts with
 MESSAGES = {
     'default': 'Hello to the World of Flask!',
-}
\ No newline at end of file
+}
+
+
+class MemoryStore:
+    '''In-process store, a dict of key -> (message, version) guarded by a lock'''
+
+    def __init__(self, initial=None):
+        # the dict starts over with every process, and so do its versions
+        self.epoch = secrets.token_hex(8)
+        self._lock = threading.Lock()
+        self._data = {key: (message, 1) for key, message in (initial or {}).items()}
+
+    def get_entry(self, key):
+        '''Returns: (message, version) or None'''
+        return self._data.get(key)
+
+    def set(self, key, message):
+        '''Returns: the new version of the key'''
+        with self._lock:
+            version = self._data[key][1] + 1 if key in self._data else 1
+            self._data[key] = (message, version)
+            return version
+
+    def get_many(self, keys):
+        '''Returns: dictionary of key -> (message, version) for the keys that exist'''
+        return {key: self._data[key] for key in keys if key in self._data}
+
+    def set_many(self, messages):
+        '''Returns: dictionary of key -> new version'''
+        with self._lock:
+            versions = {}
+            for key, message in messages.items():
+                version = self._data[key][1] + 1 if key in self._data else 1
+                self._data[key] = (message, version)
+                versions[key] = version
+            return versions
+
+    def changed_elsewhere(self):
+        # nothing outside this process can change the dict
+        return False
+
+
+class _Connection(sqlite3.Connection):
+    '''sqlite3 connection that remembers the PRAGMA data_version it last saw'''
+    seen_version = None
+
+
+class SqliteStore:
+    '''SQLite backed store, connections are pooled and reused by whichever thread needs one.
+    The threaded dev server runs every request on a new thread, so the connections can't be per thread.
+    '''
+
+    # keys per query, SQLite limits the number of bound parameters
+    CHUNK_SIZE = 500
+    # idle connections kept open, more are opened when that many requests run at once
+    POOL_SIZE = 8
+
+    def __init__(self, path, initial=None):
+        self.path = path
+        self._pool = queue.LifoQueue(maxsize=self.POOL_SIZE)
+
+        with self._connection() as conn:
+            # WAL lets readers in other workers carry on while one worker writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS messages (key TEXT PRIMARY KEY, message TEXT NOT NULL, version INTEGER NOT NULL)')
+                conn.executemany('INSERT OR IGNORE INTO messages (key, message, version) VALUES (?, ?, 1)',
+                                 list((initial or {}).items()))
+                # made once with the file, every worker and every restart reads the same one
+                conn.execute('CREATE TABLE IF NOT EXISTS store_info (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                conn.execute("INSERT OR IGNORE INTO store_info (name, value) VALUES ('epoch', ?)", (secrets.token_hex(8),))
+            self.epoch = conn.execute("SELECT value FROM store_info WHERE name = 'epoch'").fetchone()[0]
+
+    @contextmanager
+    def _connection(self):
+        # last in first out, with one request at a time the same connection is used every time
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, timeout=5, factory=_Connection, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def get_entry(self, key):
+        '''Returns: (message, version) or None'''
+        with self._connection() as conn:
+            return conn.execute('SELECT message, version FROM messages WHERE key = ?', (key,)).fetchone()
+
+    def set(self, key, message):
+        '''Returns: the new version of the key'''
+        with self._connection() as conn, conn:
+            conn.execute('''INSERT INTO messages (key, message, version) VALUES (?, ?, 1)
+                            ON CONFLICT (key) DO UPDATE SET message = excluded.message, version = version + 1''',
+                         (key, message))
+            return conn.execute('SELECT version FROM messages WHERE key = ?', (key,)).fetchone()[0]
+
+    def _select_many(self, conn, keys):
+        entries = {}
+        for i in range(0, len(keys), self.CHUNK_SIZE):
+            chunk = keys[i:i + self.CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT key, message, version FROM messages WHERE key IN ({placeholders})', chunk)
+            entries.update((key, (message, version)) for key, message, version in rows)
+        return entries
+
+    def get_many(self, keys):
+        '''Returns: dictionary of key -> (message, version) for the keys that exist'''
+        with self._connection() as conn:
+            return self._select_many(conn, list(keys))
+
+    def set_many(self, messages):
+        '''write every message in one transaction
+        Returns: dictionary of key -> new version'''
+        with self._connection() as conn, conn:
+            conn.executemany('''INSERT INTO messages (key, message, version) VALUES (?, ?, 1)
+                                ON CONFLICT (key) DO UPDATE SET message = excluded.message, version = version + 1''',
+                             list(messages.items()))
+            entries = self._select_many(conn, list(messages))
+        return {key: version for key, (_, version) in entries.items()}
+
+    def changed_elsewhere(self):
+        '''Returns: True if another connection (another worker, or another pooled connection) may have
+        committed a write since the connection used for this check last checked, always True on its first check'''
+        with self._connection() as conn:
+            # data_version only moves for commits made through other connections
+            current = conn.execute('PRAGMA data_version').fetchone()[0]
+            changed = conn.seen_version != current
+            conn.seen_version = current
+            return changed
+
+
+class CachedStore:
+    '''Read-through LRU cache in front of a MemoryStore or SqliteStore.
+    Before each read the backend is asked whether another connection wrote, if so the cache is dropped
+    so reads stay consistent across workers. Every drop bumps a generation counter: an entry read from
+    the backend before a drop may be older than the write that caused it, so it isn't cached.
+    '''
+
+    def __init__(self, backend, size=1024):
+        self.backend = backend
+        self.epoch = backend.epoch
+        self.size = size
+        self._cache = OrderedDict()  # key -> (message, version)
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def _check_outside_writes(self):
+        # checked under the lock, so no reader can use the cache between the check and the drop
+        with self._lock:
+            if self.backend.changed_elsewhere():
+                self._cache.clear()
+                self._generation += 1
+
+    def _remember(self, key, entry):
+        # must be called with the lock held, never replaces a newer version with an older one
+        cached = self._cache.get(key)
+        if cached is None or cached[1] <= entry[1]:
+            self._cache[key] = entry
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+
+    def get_entry(self, key):
+        '''Returns: (message, version) or None'''
+        self._check_outside_writes()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                return entry
+            generation = self._generation
+
+        entry = self.backend.get_entry(key)
+        if entry is not None:
+            with self._lock:
+                if self._generation == generation:
+                    self._remember(key, entry)
+        return entry
+
+    def get(self, key):
+        '''Returns: the message or None'''
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key, message):
+        '''Returns: the new version of the key'''
+        with self._lock:
+            generation = self._generation
+        version = self.backend.set(key, message)
+        with self._lock:
+            if self._generation == generation:
+                self._remember(key, (message, version))
+        return version
+
+    def get_many(self, keys):
+        '''cached keys come from memory, the rest from one backend lookup
+        Returns: dictionary of key -> (message, version) for the keys that exist'''
+        self._check_outside_writes()
+        entries = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._cache.get(key)
+                if entry is None:
+                    missing.append(key)
+                else:
+                    entries[key] = entry
+            generation = self._generation
+
+        if missing:
+            loaded = self.backend.get_many(missing)
+            with self._lock:
+                if self._generation == generation:
+                    for key, entry in loaded.items():
+                        self._remember(key, entry)
+            entries.update(loaded)
+        return entries
+
+    def set_many(self, messages):
+        '''Returns: dictionary of key -> new version'''
+        with self._lock:
+            generation = self._generation
+        versions = self.backend.set_many(messages)
+        with self._lock:
+            if self._generation == generation:
+                for key, version in versions.items():
+                    self._remember(key, (messages[key], version))
+        return versions
+
+
+def create_store(url, initial=MESSAGES, cache_size=1024):
+    '''build a store from a url: 'memory' or 'sqlite:///path/to/file.sqlite' '''
+    if url == 'memory':
+        backend = MemoryStore(initial)
+    elif url.startswith('sqlite:///'):
+        backend = SqliteStore(url[len('sqlite:///'):], initial)
+    else:
+        raise ValueError(f'Unknown message store {url!r}, use memory or sqlite:///path')
+    return CachedStore(backend, cache_size)
+
+
+store = create_store(os.environ.get('HELLO_STORE', 'memory'))
@@ -4,28 +4,169 @@
 # We don't need the application object anymore here
 #from my_app import app
 
-from flask import Blueprint
-from my_app.hello.models import MESSAGES
+# Repeat reads are cheap:
+# every message response carries an ETag made from the key, its version and the store's epoch,
+# a client sending that ETag back in If-None-Match gets an empty 304 while the message is unchanged,
+# and the encoded body of each hot key is kept in RESPONSE_CACHE until /add/ writes that key.
+#
+# Many keys at once:
+#   GET /messages?key=default&key=great (or ?keys=default,great) - one JSON object with every message
+#   POST /messages {"great": "Flask is great!!", ...} - add or update every key in one write
+# Reads of more than BATCH_SIZE keys are streamed, BATCH_SIZE keys are looked up at a time.
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from flask import Blueprint, Response, request, make_response, jsonify
+from my_app.hello.models import store
 
 
 # our routing is defined on the 'hello' blueprint
 hello = Blueprint('hello', __name__)
 
+
+class ResponseCache:
+    '''LRU of key -> ((store epoch, version), etag, encoded body) for the message routes'''
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        '''Returns: (etag, body) if cached for this exact version, otherwise None'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key, version, etag, body):
+        with self._lock:
+            self._entries[key] = (version, etag, body)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+RESPONSE_CACHE = ResponseCache()
+
+# keys per store lookup in a multi-key read, bigger reads are streamed
+BATCH_SIZE = 500
+
+
+def make_etag(key, version):
+    # versions restart at 1 in a new store, the epoch keeps a restarted (or another worker's) memory store
+    # from handing out the same ETag for a different message
+    return hashlib.sha1(f'{store.epoch}\0{key}\0{version}'.encode('utf-8')).hexdigest()[:20]
+
+
+def message_response(key):
+    '''Response for the message stored under key: a 304 when the client's copy is current,
+    otherwise the body from RESPONSE_CACHE, rendering it only on a cache miss'''
+    entry = store.get_entry(key)
+    if entry is None:
+        return f'{key} not found!'
+    message, version = entry
+
+    cached = RESPONSE_CACHE.get(key, (store.epoch, version))
+    if cached is None:
+        etag = make_etag(key, version)
+        body = message.encode('utf-8')
+        RESPONSE_CACHE.put(key, (store.epoch, version), etag, body)
+    else:
+        etag, body = cached
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+        response.mimetype = 'text/html'
+    response.set_etag(etag)
+    # browsers may keep the copy but have to check back, which is what the ETag is for
+    response.cache_control.no_cache = True
+    return response
+
 # Instead of @app.route, we use @hello.route
 
 @hello.route('/')  # http://127.0.0.1:5000/
 @hello.route('/hello')  #http://127.0.0.1:5000/hello
 def hello_world():
-    return MESSAGES['default']
+    return message_response('default')
 
 @hello.route('/show/<key>')  # http://127.0.0.1:5000/show/default
 def get_message(key):
     '''View a message after providing its key via the above Url route
     if the key provided is not found display message saying so'''
-    return MESSAGES.get(key) or f'{key} not found!'
+    return message_response(key)
 
 @hello.route('/add/<key>/<message>')  # http://127.0.0.1:5000/add/great/Flask%20is%20great!!
 def add_or_update_message(key, message):
-    '''add or update a key,value to MESSAGES via the above Url route'''
-    MESSAGES[key] = message
+    '''add or update a key,value in the message store via the above Url route'''
+    store.set(key, message)
+    # the cached response of this key is out of date now, nothing else is touched
+    RESPONSE_CACHE.invalidate(key)
     return f'{key} has been Added//Updated!'
+
+def requested_keys():
+    '''the keys of a multi-key read, from repeated ?key= and comma separated ?keys=
+    Returns: list of keys without duplicates, in the order asked for'''
+    keys = request.args.getlist('key')
+    for value in request.args.getlist('keys'):
+        keys.extend(key for key in value.split(',') if key)
+    return list(dict.fromkeys(keys))
+
+
+def stream_messages(keys):
+    '''the same JSON object as a small read, produced BATCH_SIZE keys at a time'''
+    missing = []
+    separator = ''
+    yield '{"messages": {'
+    for i in range(0, len(keys), BATCH_SIZE):
+        batch = keys[i:i + BATCH_SIZE]
+        entries = store.get_many(batch)
+        items = []
+        for key in batch:
+            if key in entries:
+                items.append(f'{json.dumps(key)}: {json.dumps(entries[key][0])}')
+            else:
+                missing.append(key)
+        if items:
+            yield separator + ', '.join(items)
+            separator = ', '
+    yield '}, "missing": ' + json.dumps(missing) + '}'
+
+@hello.route('/messages', methods=['GET'])  # http://127.0.0.1:5000/messages?key=default&key=great
+def get_messages():
+    '''View many messages in one response: {"messages": {key: message}, "missing": [keys not found]}'''
+    keys = requested_keys()
+    if not keys:
+        return jsonify(error='ask for at least one key with ?key= or ?keys='), 400
+
+    if len(keys) > BATCH_SIZE:
+        return Response(stream_messages(keys), mimetype='application/json')
+
+    entries = store.get_many(keys)
+    return jsonify(messages={key: entries[key][0] for key in keys if key in entries},
+                   missing=[key for key in keys if key not in entries])
+
+@hello.route('/messages', methods=['POST'])
+def add_or_update_messages():
+    '''add or update many keys at once, the body is a JSON object of key -> message
+    Returns: {"updated": {key: new version}}'''
+    messages = request.get_json(silent=True)
+    if not isinstance(messages, dict) or not messages:
+        return jsonify(error='send a JSON object of key -> message'), 400
+    if not all(isinstance(message, str) for message in messages.values()):
+        return jsonify(error='every message must be a string'), 400
+
+    versions = store.set_many(messages)
+    for key in messages:
+        RESPONSE_CACHE.invalidate(key)
+    return jsonify(updated=versions)
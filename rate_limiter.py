@@ -0,0 +1,56 @@
+# A token-bucket rate limiter shared by every thread in the process.
+
+# The bucket holds up to 'capacity' tokens and refills at 'rate' tokens per second.
+# Each request takes one token before it is sent; if the bucket is empty the caller waits
+# only as long as it takes for the next token to drip in.
+# Unlike a fixed time.sleep() after each response, the wait does not include the round-trip time,
+# so N workers together run at the allowed rate instead of 1 / (latency + sleep).
+
+import threading
+import time
+
+
+class TokenBucket:
+    '''Thread-safe token bucket.
+    Params:
+        rate - tokens added per second (the sustained request budget)
+        capacity - the most tokens the bucket can hold (the allowed burst), defaults to rate
+    '''
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('rate must be greater than 0')
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        # must be called with the lock held
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        '''Block until 'tokens' tokens are available, then take them.
+        Returns: the number of seconds spent waiting
+        '''
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+
+            # sleep outside the lock so other threads can refund or check the bucket
+            time.sleep(delay)
+            waited += delay
+
+    def refund(self, tokens=1):
+        '''Give tokens back, e.g. when the request was answered from the local cache'''
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + tokens)
@@ -0,0 +1,207 @@
+"""Breadth-first site crawler built on metadata_scraper."""
+# Each fetched page goes through the metadata and word-count extractors, its links are
+# normalized (see iter_site_links) and the new ones are queued one level deeper.
+#
+# Both the frontier and the visited index live in SQLite, so memory stays flat at millions of urls:
+#   visited - one row per url ever queued, keyed by its 64 bit hash (INTEGER PRIMARY KEY = rowid),
+#             "have we seen it" is a single indexed lookup
+#   frontier - urls waiting to be fetched, popped shallowest first (breadth first)
+# Stopping and starting again continues from the same frontier, --fresh starts over.
+
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import http_client
+from metadata_scraper import HEADERS, extract_metadata, normalize_url, to_plain, url_key
+
+
+class CrawlIndex:
+    """On-disk visited set and priority frontier."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS visited (key INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS frontier (id INTEGER PRIMARY KEY AUTOINCREMENT, depth INTEGER, url TEXT);
+            CREATE INDEX IF NOT EXISTS frontier_order ON frontier (depth, id);
+        ''')
+        self.queued = self.conn.execute('SELECT COUNT(*) FROM frontier').fetchone()[0]
+
+    def reset(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM visited')
+            self.conn.execute('DELETE FROM frontier')
+        self.queued = 0
+
+    def push(self, url, depth):
+        """Queue url unless it was seen before. Returns True if it was queued."""
+        # SQLite integers are signed 64 bit
+        key = url_key(url) - (1 << 63)
+        if self.conn.execute('INSERT OR IGNORE INTO visited (key) VALUES (?)', (key,)).rowcount == 0:
+            return False
+        self.conn.execute('INSERT INTO frontier (depth, url) VALUES (?, ?)', (depth, url))
+        self.queued += 1
+        return True
+
+    def pop(self):
+        """Take the shallowest queued url. Returns (url, depth) or None when the frontier is empty."""
+        row = self.conn.execute('SELECT id, url, depth FROM frontier ORDER BY depth, id LIMIT 1').fetchone()
+        if row is None:
+            return None
+        self.conn.execute('DELETE FROM frontier WHERE id = ?', (row[0],))
+        self.queued -= 1
+        return row[1], row[2]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class RobotsRules:
+    """robots.txt of every host, fetched once per host through http_client."""
+
+    def __init__(self, user_agent=HEADERS['User-Agent']):
+        self.user_agent = user_agent
+        self._parsers = {}
+
+    def allowed(self, url):
+        parts = urlsplit(url)
+        origin = f'{parts.scheme}://{parts.netloc}'
+
+        if origin not in self._parsers:
+            parser = RobotFileParser(f'{origin}/robots.txt')
+            try:
+                response = http_client.get(parser.url, headers=HEADERS)
+                if response.status_code >= 400:
+                    # no robots.txt, everything is allowed
+                    parser.parse([])
+                else:
+                    parser.parse(response.text.splitlines())
+            except Exception as err:
+                logging.warning(f'{parser.url}: {err}')
+                parser.parse([])
+            self._parsers[origin] = parser
+
+        return self._parsers[origin].can_fetch(self.user_agent, url)
+
+
+def fetch_page(url):
+    """Download and extract one page, runs in a worker thread."""
+    response = http_client.get(url, headers=HEADERS)
+    response.raise_for_status()
+    if 'html' not in response.headers.get('Content-Type', 'text/html'):
+        raise ValueError(f'not an html page: {response.headers.get("Content-Type")}')
+
+    metadata = extract_metadata(response.content, url)
+    metadata.pop('img')
+    return metadata
+
+
+def crawl(start_url, out=sys.stdout, max_pages=100, max_depth=2, workers=8, index_path='crawl_index.sqlite',
+          same_domain=True, obey_robots=True, fresh=False, report_every=5.0):
+    """Crawl breadth first from start_url, writing one JSON line per page to out.
+
+    Links are followed up to max_depth levels from the start page, only on the start host
+    when same_domain is set, and only where robots.txt allows when obey_robots is set.
+    Returns the number of pages fetched.
+    """
+    index = CrawlIndex(index_path)
+    if fresh:
+        index.reset()
+
+    start_url = normalize_url(start_url)
+    start_host = urlsplit(start_url).hostname
+    index.push(start_url, 0)
+    robots = RobotsRules()
+
+    pages = errors = 0
+    started = last_report = time.monotonic()
+    in_flight = {}  # future -> (url, depth)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                # keep every worker busy
+                while len(in_flight) < workers and pages + errors + len(in_flight) < max_pages:
+                    item = index.pop()
+                    if item is None:
+                        break
+                    url, depth = item
+                    if obey_robots and not robots.allowed(url):
+                        continue
+                    in_flight[pool.submit(fetch_page, url)] = (url, depth)
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = in_flight.pop(future)
+                    try:
+                        metadata = future.result()
+                    except Exception as err:
+                        errors += 1
+                        out.write(json.dumps({'url': url, 'depth': depth, 'error': f'{type(err).__name__}: {err}'}) + '\n')
+                        continue
+
+                    pages += 1
+                    links = metadata.pop('links', {})
+                    if depth < max_depth:
+                        for link in links:
+                            if not same_domain or urlsplit(link).hostname == start_host:
+                                index.push(link, depth + 1)
+
+                    record = to_plain(metadata)
+                    record['depth'] = depth
+                    record['link_count'] = len(links)
+                    out.write(json.dumps(record) + '\n')
+
+                index.commit()
+
+                now = time.monotonic()
+                if now - last_report >= report_every:
+                    last_report = now
+                    rate = pages / (now - started)
+                    print(f'{pages} pages, {errors} errors, {rate:.1f} pages/s, {index.queued} queued',
+                          file=sys.stderr, flush=True)
+    finally:
+        # urls still in flight were already taken off the frontier, put them back for the next run
+        for url, depth in in_flight.values():
+            index.conn.execute('INSERT INTO frontier (depth, url) VALUES (?, ?)', (depth, url))
+        index.close()
+
+    elapsed = time.monotonic() - started
+    print(f'done: {pages} pages, {errors} errors in {elapsed:.1f}s', file=sys.stderr)
+    return pages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Crawl a site breadth first, one JSON object per page')
+    parser.add_argument('url', help='the page to start from')
+    parser.add_argument('--max-pages', type=int, default=100)
+    parser.add_argument('--max-depth', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=8, help='concurrent fetches')
+    parser.add_argument('--index', default='crawl_index.sqlite', help='file for the visited index and frontier')
+    parser.add_argument('--all-domains', action='store_true', help='follow links to other hosts too')
+    parser.add_argument('--ignore-robots', action='store_true')
+    parser.add_argument('--fresh', action='store_true', help='forget the previous crawl in the index')
+    parser.add_argument('--output', default='-', help='file for the JSON lines, - for stdout')
+    args = parser.parse_args()
+
+    http_client.install_cache()
+    http_client.configure(pool_maxsize=max(args.workers, http_client.SETTINGS['pool_maxsize']))
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'a', encoding='utf-8')
+    with out:
+        crawl(args.url, out, max_pages=args.max_pages, max_depth=args.max_depth, workers=args.workers,
+              index_path=args.index, same_domain=not args.all_domains, obey_robots=not args.ignore_robots,
+              fresh=args.fresh)